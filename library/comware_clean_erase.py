@@ -27,6 +27,17 @@ options:
         default: null
         choices: ['true', 'false']
         aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -65,7 +76,8 @@ EXAMPLES = """
 
 """
 
-import socket
+from ansible.module_utils.comware_cache import (
+    resolve_hostname, invalidate_snapshot)
 try:
     HAS_PYHP = True
     from pyhpecw7.features.cleanerase import CleanErase
@@ -92,6 +104,7 @@ def main():
     module = AnsibleModule(
         argument_spec=dict(
             factory_default=dict(default=False, choices=BOOLEANS, type='bool'),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(default=830, type='int'),
             hostname=dict(required=True),
             username=dict(required=True),
@@ -107,7 +120,8 @@ def main():
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
 
     device_args = dict(host=hostname, username=username,
                        password=password, port=port)
@@ -143,6 +157,7 @@ def main():
                       commands=commands)
         else:
             try:
+                invalidate_snapshot(hostname, port)
                 device.execute_staged()
                 changed = True
             except PYHPError as e:
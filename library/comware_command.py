@@ -11,6 +11,10 @@ version_added: 1.8
 category: Feature (RW)
 notes:
     - This module is not idempotent
+    - With hosts, the commands are run on every switch in the list
+      from a single task, each over its own NETCONF session.  A switch
+      that fails or times out does not stop the others; the task fails
+      after all of them are done and lists the failed_hosts.
 options:
     type:
         description:
@@ -30,6 +34,86 @@ options:
         default: null
         choices: []
         aliases: []
+    per_command:
+        description:
+            - Send each command in the list in its own request over the
+              same NETCONF session and return a responses list with the
+              response and elapsed time of each command, instead of a
+              single response for all of them.  A config command that
+              must be entered in a view can be grouped with the view
+              as a nested list.
+        required: false
+        default: false
+        choices: ['true', 'false', 'yes', 'no']
+        aliases: []
+    stop_on_error:
+        description:
+            - With per_command, skip the remaining commands after the
+              first command that fails.  Otherwise every command is
+              sent and the module fails after the last one.
+        required: false
+        default: true
+        choices: ['true', 'false', 'yes', 'no']
+        aliases: []
+    parse:
+        description:
+            - Return the output of display commands the module has a
+              parser for as structured data in parsed, alongside the
+              raw response.  The commands parsed are display interface
+              brief, display ip interface brief, display lldp
+              neighbor-information list, display vlan brief, display
+              version, display arp and display mac-address, also
+              when their keywords are abbreviated.  A response the
+              parser cannot read is only returned raw.
+        required: false
+        default: true
+        choices: ['true', 'false', 'yes', 'no']
+        aliases: []
+    hosts:
+        description:
+            - List of IP addresses or hostnames of Comware 7 devices to
+              run the commands on instead of hostname.  Typically used
+              with run_once to drive many switches from one task.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+    workers:
+        description:
+            - Maximum number of switches that hosts are run on at
+              the same time
+        required: false
+        default: 50
+        choices: []
+        aliases: []
+    host_timeout:
+        description:
+            - NETCONF timeout in seconds for each switch in hosts
+        required: false
+        default: 30
+        choices: []
+        aliases: []
+    output_file:
+        description:
+            - Local file the result of each switch in hosts is written
+              to as one JSON object per line as soon as the switch is
+              done.  When set, the responses are not returned by the
+              module, only the list of failed_hosts.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -40,8 +124,8 @@ options:
     hostname:
         description:
             - IP Address or hostname of the Comware 7 device that has
-              NETCONF enabled
-        required: true
+              NETCONF enabled.  Required unless hosts is used.
+        required: false
         default: null
         choices: []
         aliases: []
@@ -87,10 +171,63 @@ EXAMPLES = """
     password: "{{ password }}"
     hostname: "{{ inventory_hostname }}"
 
+# one response per display command, sent over the same session
+- comware_command:
+    command:
+      - display vlan brief
+      - display interface brief
+      - display lldp neighbor-information list
+    type: display
+    per_command: true
+    username: "{{ username }}"
+    password: "{{ password }}"
+    hostname: "{{ inventory_hostname }}"
+
+# structured data for a display command
+- comware_command:
+    command: display interface brief
+    type: display
+    username: "{{ username }}"
+    password: "{{ password }}"
+    hostname: "{{ inventory_hostname }}"
+  register: brief
+
+- debug: msg="{{ brief.parsed | selectattr('link', 'equalto', 'DOWN') | map(attribute='interface') | list }}"
+
+# config commands with their views grouped, stopping on the first error
+- comware_command:
+    command:
+      - [vlan 5, name web_vlan]
+      - [vlan 6, name db_vlan]
+      - ip route-static 0.0.0.0 0 10.1.1.1
+    type: config
+    per_command: true
+    stop_on_error: true
+    username: "{{ username }}"
+    password: "{{ password }}"
+    hostname: "{{ inventory_hostname }}"
+
+# run a display command on every switch in the play from one task
+- comware_command:
+    command: display version
+    type: display
+    hosts: "{{ play_hosts }}"
+    workers: 100
+    output_file: /tmp/display_version.jsonl
+    username: "{{ username }}"
+    password: "{{ password }}"
+  run_once: true
+
 """
 
 import socket
 import sys
+import json
+import re
+import time
+from multiprocessing.pool import ThreadPool
+from ansible.module_utils.comware_cache import (
+    resolve_hostname, invalidate_snapshot)
 try:
     HAS_PYHP = True
     from pyhpecw7.comware import HPCOM7
@@ -111,13 +248,308 @@ def safe_exit(module, device=None, **kwargs):
     module.exit_json(**kwargs)
 
 
+MAC = r'[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}'
+
+INTERFACE_ROUTE_RE = re.compile(
+    r'^(?P<interface>\S+)\s+(?P<link>UP|DOWN|ADM|Stby)\s+'
+    r'(?P<protocol>\S+)\s+(?P<primary_ip>\S+)\s*(?P<description>.*)$')
+INTERFACE_BRIDGE_RE = re.compile(
+    r'^(?P<interface>\S+)\s+(?P<link>UP|DOWN|ADM|Stby)\s+'
+    r'(?P<speed>\S+)\s+(?P<duplex>\S+)\s+(?P<type>[ATH])\s+'
+    r'(?P<pvid>\d+)\s*(?P<description>.*)$')
+IP_INTERFACE_RE = re.compile(
+    r'^(?P<interface>\S+)\s+(?P<physical>\*?down|up|\S+)\s+'
+    r'(?P<protocol>\S+)\s+(?P<ip_address>\S+)\s*(?P<description>.*)$')
+LLDP_RE = re.compile(
+    r'^(?P<system_name>.+?)\s+(?P<local_interface>\S+)\s+'
+    r'(?P<chassis_id>' + MAC + r')\s+(?P<port_id>\S+)\s*$')
+ARP_RE = re.compile(
+    r'^(?P<ip_address>\d+\.\d+\.\d+\.\d+)\s+(?P<mac_address>' + MAC +
+    r')\s+(?P<vlan>\S+)\s+(?P<interface>\S+)\s+(?P<aging>\S+)\s+'
+    r'(?P<type>\S+)\s*$')
+MAC_RE = re.compile(
+    r'^(?P<mac_address>' + MAC + r')\s+(?P<vlan>\d+)\s+(?P<state>\S+)\s+'
+    r'(?P<interface>\S+)\s+(?P<aging>\S+)\s*$')
+VERSION_RE = re.compile(r'Comware Software, Version (?P<version>[^,\s]+)'
+                        r'(?:, Release (?P<release>\S+))?')
+UPTIME_RE = re.compile(r'^(?P<model>.+?) uptime is (?P<uptime>.+)$', re.M)
+REBOOT_RE = re.compile(r'^Last reboot reason\s*:\s*(?P<reason>.+)$', re.M)
+
+
+def parse_rows(regex, response, header):
+    """Return a dict for each line matching regex after the
+    line starting with header.
+    """
+    rows = []
+    found = False
+    for line in response.splitlines():
+        if line.startswith(header):
+            found = True
+            continue
+        match = regex.match(line.strip()) if found else None
+        if match:
+            rows.append(match.groupdict())
+    return rows
+
+
+def parse_interface_brief(response):
+    rows = []
+    regex = None
+    for line in response.splitlines():
+        if line.startswith('Brief information'):
+            regex = None
+            continue
+        if line.startswith('Interface'):
+            if 'Protocol' in line:
+                regex, mode = INTERFACE_ROUTE_RE, 'route'
+            else:
+                regex, mode = INTERFACE_BRIDGE_RE, 'bridge'
+            continue
+        match = regex.match(line.strip()) if regex else None
+        if match:
+            row = match.groupdict()
+            row['mode'] = mode
+            rows.append(row)
+    return rows
+
+
+def parse_ip_interface_brief(response):
+    return parse_rows(IP_INTERFACE_RE, response, 'Interface')
+
+
+def parse_lldp_neighbor_list(response):
+    return parse_rows(LLDP_RE, response, 'System Name')
+
+
+def parse_arp(response):
+    return parse_rows(ARP_RE, response, 'IP address')
+
+
+def parse_mac_address(response):
+    return parse_rows(MAC_RE, response, 'MAC Address')
+
+
+def parse_vlan_brief(response):
+    """The port list of a VLAN wraps onto lines that are blank
+    up to the Port column.
+    """
+    vlans = []
+    name_col = port_col = None
+    for line in response.splitlines():
+        if line.startswith('VLAN ID'):
+            name_col = line.index('Name')
+            port_col = line.index('Port')
+            continue
+        if name_col is None or not line.strip():
+            continue
+        vlan_id = line[:name_col].strip()
+        ports = line[port_col:].split()
+        if vlan_id.isdigit():
+            vlans.append(dict(vlan_id=vlan_id,
+                              name=line[name_col:port_col].strip(),
+                              ports=ports))
+        elif vlans and not line[:port_col].strip():
+            vlans[-1]['ports'].extend(ports)
+    return vlans
+
+
+def parse_version(response):
+    version = {}
+    for regex in [VERSION_RE, UPTIME_RE]:
+        match = regex.search(response)
+        if match:
+            version.update(match.groupdict())
+    match = REBOOT_RE.search(response)
+    if match:
+        version['last_reboot_reason'] = match.group('reason').strip()
+    return version
+
+
+# keywords of the display commands with a parser.  Commands are
+# matched with their keywords shortened as on the device.
+PARSERS = [
+    (['display', 'interface', 'brief'], parse_interface_brief),
+    (['display', 'ip', 'interface', 'brief'], parse_ip_interface_brief),
+    (['display', 'lldp', 'neighbor-information', 'list'],
+     parse_lldp_neighbor_list),
+    (['display', 'vlan', 'brief'], parse_vlan_brief),
+    (['display', 'version'], parse_version),
+    (['display', 'arp'], parse_arp),
+    (['display', 'mac-address'], parse_mac_address),
+]
+
+
+def get_parser(command):
+    """Return the parser for a display command, or None.  Arguments
+    and output filters after the keywords are ignored.
+    """
+    if isinstance(command, list):
+        return None
+    words = command.lower().split()
+    for keywords, parser in PARSERS:
+        if len(words) < len(keywords):
+            continue
+        if all(keyword.startswith(word) and
+               len(word) >= 2
+               for word, keyword in zip(words, keywords)):
+            return parser
+    return None
+
+
+def parse_response(command, response):
+    """Return the structured data of the response to a display
+    command, or None when there is no parser for the command or
+    the response is not laid out the way the parser expects.
+    """
+    parser = get_parser(command)
+    if parser and response:
+        # an unexpected output format only costs the parsed data,
+        # the raw response is still returned
+        try:
+            return parser(response)
+        except (ValueError, IndexError, KeyError, AttributeError):
+            return None
+    return None
+
+
+def run_each(device, ctype, commands, stop_on_error=True, parse=False):
+    """Send each command in its own request over the open session
+    and return a list with the response and timing of each.  An
+    item that is itself a list, such as a view followed by the
+    commands to enter in it, is sent as a single request.
+    """
+    responses = []
+    for command in commands:
+        result = dict(command=command)
+        start = time.time()
+        try:
+            if ctype in ['show', 'display']:
+                result['response'] = device.cli_display(command)
+                if parse:
+                    parsed = parse_response(command, result['response'])
+                    if parsed is not None:
+                        result['parsed'] = parsed
+            elif ctype in ['config']:
+                result['response'] = device.cli_config(command)
+        except PYHPError as e:
+            result['failed'] = str(e)
+        result['elapsed'] = round(time.time() - start, 2)
+        responses.append(result)
+        if result.get('failed') and stop_on_error:
+            break
+
+    return responses
+
+
+def run_on_host(host, params):
+    """Run the commands on one switch in its own NETCONF session
+    and return the result.
+    """
+    result = dict(host=host)
+    start = time.time()
+    device = None
+    # any error is reported against the switch it happened on
+    # rather than stopping the commands on the other switches
+    try:
+        address = resolve_hostname(host, params['dns_ttl'])
+        device = HPCOM7(host=address, username=params['username'],
+                        password=params['password'], port=params['port'],
+                        timeout=params['host_timeout'])
+        device.open()
+        if params['per_command']:
+            responses = run_each(device, params['type'], params['command'],
+                                 params['stop_on_error'], params['parse'])
+            result['responses'] = responses
+            failed = [each['command'] for each in responses
+                      if each.get('failed')]
+            if failed:
+                result['failed'] = 'commands failed: {0}'.format(failed)
+        elif params['type'] in ['show', 'display']:
+            result['response'] = device.cli_display(params['command'])
+            if params['parse']:
+                parsed = parse_response(params['command'],
+                                        result['response'])
+                if parsed is not None:
+                    result['parsed'] = parsed
+        else:
+            result['response'] = device.cli_config(params['command'])
+        if params['type'] in ['config']:
+            invalidate_snapshot(address, params['port'])
+    except (PYHPError, socket.error) as e:
+        result['failed'] = str(e) or e.__class__.__name__
+    finally:
+        if device:
+            try:
+                device.close()
+            except (PYHPError, socket.error):
+                pass
+
+    result['elapsed'] = round(time.time() - start, 2)
+    return result
+
+
+def run_on_hosts(module, config_string):
+    """Run the commands on every switch in hosts on a pool of
+    workers, writing each result to output_file as a JSON line
+    as soon as the switch is done, and exit.
+    """
+    hosts = module.params['hosts']
+    output_file = module.params['output_file']
+
+    if module.check_mode:
+        safe_exit(module, changed=True, config_string=config_string)
+
+    def run(host):
+        return run_on_host(host, module.params)
+
+    responses = {}
+    failed = []
+    output = open(output_file, 'w') if output_file else None
+    pool = ThreadPool(max(1, min(module.params['workers'], len(hosts))))
+    try:
+        for result in pool.imap_unordered(run, hosts):
+            if result.get('failed'):
+                failed.append(result['host'])
+            if output:
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+            else:
+                responses[result['host']] = result
+    finally:
+        pool.close()
+        if output:
+            output.close()
+
+    results = {}
+    results['config_string'] = config_string
+    results['changed'] = True
+    results['hosts'] = len(hosts)
+    results['failed_hosts'] = sorted(failed)
+    if output_file:
+        results['output_file'] = output_file
+    else:
+        results['responses'] = responses
+    if failed:
+        safe_fail(module, msg='commands failed on {0} of {1} hosts'.format(
+            len(failed), len(hosts)), **results)
+    safe_exit(module, **results)
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
             type=dict(required=True, choices=['display', 'show', 'config']),
             command=dict(required=True),
+            per_command=dict(default=False, choices=BOOLEANS, type='bool'),
+            stop_on_error=dict(default=True, choices=BOOLEANS, type='bool'),
+            parse=dict(default=True, choices=BOOLEANS, type='bool'),
+            hosts=dict(type='list'),
+            workers=dict(default=50, type='int'),
+            host_timeout=dict(default=30, type='int'),
+            output_file=dict(),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(default=830, type='int'),
-            hostname=dict(required=True),
+            hostname=dict(required=False),
             username=dict(required=True),
             password=dict(required=True),
         ),
@@ -128,10 +560,31 @@ def main():
         safe_fail(module, msg='There was a problem loading from the pyhpecw7 '
                   + 'module.', error=str(ie), path=str(sys.path))
 
+    if module.params['hostname'] and module.params['hosts']:
+        module.fail_json(msg='hostname and hosts are mutually exclusive')
+    if not (module.params['hostname'] or module.params['hosts']):
+        module.fail_json(msg='one of hostname or hosts is required')
+
+    command = module.params['command']
+    if isinstance(command, list):
+        config_string = ';'.join(
+            ';'.join(each) if isinstance(each, list) else each
+            for each in command)
+    else:
+        config_string = command
+
+    if module.params['per_command']:
+        if not isinstance(command, list):
+            module.params['command'] = command = [command]
+
+    if module.params['hosts']:
+        run_on_hosts(module, config_string)
+
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
 
     device_args = dict(host=hostname, username=username,
                        password=password, port=port)
@@ -139,7 +592,6 @@ def main():
     device = HPCOM7(**device_args)
 
     ctype = module.params['type']
-    command = module.params['command']
 
     changed = False
 
@@ -153,23 +605,33 @@ def main():
 
     
     response = None
-    if isinstance(command, list):
-        config_string = ';'.join(command)
-    else:
-        config_string = command
     
     if module.check_mode:
         safe_exit(module, device, changed=True,
                   config_string=config_string)
 
-    try:
-        if ctype in ['show', 'display']:
-            response = device.cli_display(command)
-        elif ctype in ['config']:
-            response = device.cli_config(command)
-    except PYHPError as e:
-        safe_fail(module, device, msg=str(e),
-                  descr='error during execution')        
+    if module.params['per_command']:
+        responses = run_each(device, ctype, command,
+                             module.params['stop_on_error'],
+                             module.params['parse'])
+        if ctype in ['config']:
+            invalidate_snapshot(hostname, port)
+        failed = [each['command'] for each in responses
+                  if each.get('failed')]
+        if failed:
+            safe_fail(module, device, msg='commands failed: {0}'.format(
+                failed), descr='error during execution',
+                responses=responses)
+    else:
+        try:
+            if ctype in ['show', 'display']:
+                response = device.cli_display(command)
+            elif ctype in ['config']:
+                response = device.cli_config(command)
+                invalidate_snapshot(hostname, port)
+        except PYHPError as e:
+            safe_fail(module, device, msg=str(e),
+                      descr='error during execution')        
 
     changed = True
 
@@ -178,7 +640,14 @@ def main():
     results['config_string'] = config_string
     results['changed'] = changed
     results['end_state'] = 'N/A for this module.'
-    results['response'] = response
+    if module.params['per_command']:
+        results['responses'] = responses
+    else:
+        results['response'] = response
+        if ctype in ['show', 'display'] and module.params['parse']:
+            parsed = parse_response(command, response)
+            if parsed is not None:
+                results['parsed'] = parsed
 
     safe_exit(module, device, **results)
 
@@ -9,17 +9,56 @@ description:
     - Gather fact data (characteristics) of Comware 7 devices
 version_added: 1.8
 category: Read-Only
+notes:
+    - The facts of every group in gather_subset are collected with
+      a single NETCONF get.
+    - With snapshot_ttl, the inventory and interfaces groups are
+      cached on the controller.  The base group is fetched on every
+      run and used as a probe; the cache is refreshed when the uptime
+      shows the switch rebooted or the hostname changed.  Config
+      changes made through the modules of this library clear it.
+      The groups served from the cache are returned in cached.
 return_data:
-    - vendor
-    - model
-    - serial_number
-    - uptime
-    - hostname
-    - os
-    - localtime
-    - config (name of running config)
-    - interface_list
+    - vendor (inventory)
+    - model (inventory)
+    - serial_number (inventory)
+    - hardware (inventory)
+    - os (inventory)
+    - uptime (base)
+    - hostname (base)
+    - localtime (base)
+    - interface_list (interfaces)
 options:
+    gather_subset:
+        description:
+            - List of fact groups to collect: inventory (os, model,
+              serial_number, hardware), base (hostname, localtime,
+              uptime) and interfaces (interface_list), or all.  A group
+              prefixed with ! is left out, e.g. ['!interfaces'] collects
+              all facts but the interface list.
+        required: false
+        default: ['all']
+        choices: []
+        aliases: []
+    snapshot_ttl:
+        description:
+            - Maximum age in seconds of the facts cached on the
+              controller for this switch.  0 disables the cache.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -56,13 +95,29 @@ EXAMPLES = """
 # get facts
 - comware_facts: username={{ username }} password={{ password }} hostname={{ inventory_hostname }}
 
+# get only the OS version and model
+- comware_facts: gather_subset=inventory username={{ username }} password={{ password }} hostname={{ inventory_hostname }}
+
+# reuse the inventory cached by earlier plays unless the switch rebooted
+- comware_facts: gather_subset=inventory snapshot_ttl=86400 username={{ username }} password={{ password }} hostname={{ inventory_hostname }}
+
+# get everything but the interface list
+- comware_facts:
+    gather_subset: ['!interfaces']
+    username: "{{ username }}"
+    password: "{{ password }}"
+    hostname: "{{ inventory_hostname }}"
+
 """
 
-import socket
+import time
+from collections import OrderedDict
+from ansible.module_utils.comware_cache import (
+    resolve_hostname, load_snapshot, update_snapshot)
 try:
     HAS_PYHP = True
-    from pyhpecw7.features.facts import Facts
     from pyhpecw7.comware import HPCOM7
+    from pyhpecw7.utils.xml.lib import *
     from pyhpecw7.features.errors import *
     from pyhpecw7.errors import *
 except ImportError as ie:
@@ -81,9 +136,183 @@ def safe_exit(module, device=None, **kwargs):
     module.exit_json(**kwargs)
 
 
+FACT_SUBSETS = ['inventory', 'base', 'interfaces']
+
+
+def get_subsets(gather_subset):
+    """Return the fact groups selected by gather_subset.  A group
+    prefixed with ! is excluded from the others, or from all.
+    """
+    include = set()
+    exclude = set()
+    for subset in gather_subset:
+        subset = subset.strip()
+        target = exclude if subset.startswith('!') else include
+        subset = subset.lstrip('!')
+        if subset == 'all':
+            target.update(FACT_SUBSETS)
+        elif subset in FACT_SUBSETS:
+            target.add(subset)
+        else:
+            raise ValueError(subset)
+    if not include:
+        include.update(FACT_SUBSETS)
+
+    return [subset for subset in FACT_SUBSETS
+            if subset in include and subset not in exclude]
+
+
+def format_uptime(seconds):
+    """Convert seconds to d, hr, min, sec format.
+    """
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    d, h = divmod(h, 24)
+    return '{0}d {1}hr {2}min {3}sec'.format(d, h, m, s)
+
+
+def get_facts(device, subsets):
+    """Get the facts of the selected groups with one NETCONF get
+    combining the filter of each group.
+
+    Returns:
+        A dictionary of the facts of each group keyed by group.
+        The uptime of the base group is in seconds.
+    """
+    E = data_element_maker()
+    filters = []
+    if 'inventory' in subsets:
+        filters.append(
+            E.LLDP(
+                E.Inventory(
+                    E.SoftwareRev(),
+                    E.SerialNum(),
+                    E.ModelName(),
+                    E.HardwareRev()
+                )
+            )
+        )
+    if 'base' in subsets:
+        filters.append(
+            E.Device(
+                E.Base(
+                    E.HostName(),
+                    E.LocalTime(),
+                    E.Uptime()
+                )
+            )
+        )
+    if 'interfaces' in subsets:
+        filters.append(
+            E.Ifmgr(
+                E.Interfaces(
+                    E.Interface(
+                        E.Name()
+                    )
+                )
+            )
+        )
+
+    groups = {}
+    if not filters:
+        return groups
+
+    nc_get_reply = device.get(('subtree', E.top(*filters)))
+    data = nc_get_reply.data_ele
+
+    if 'inventory' in subsets:
+        inventory = find_in_data('Inventory', data)
+        key_map = {
+            'os': 'SoftwareRev',
+            'serial_number': 'SerialNum',
+            'model': 'ModelName',
+            'hardware': 'HardwareRev'
+        }
+        facts = {}
+        if inventory is not None:
+            facts.update(data_elem_to_dict(inventory, key_map))
+        facts['vendor'] = 'hp'
+        groups['inventory'] = facts
+    if 'base' in subsets:
+        base = find_in_data('Base', data)
+        key_map = {
+            'hostname': 'HostName',
+            'localtime': 'LocalTime',
+            'uptime': 'Uptime'
+        }
+        facts = {}
+        if base is not None:
+            facts.update(data_elem_to_dict(base, key_map))
+        facts['uptime'] = int(facts.get('uptime') or 0)
+        groups['base'] = facts
+    if 'interfaces' in subsets:
+        ifmgr = find_in_data('Ifmgr', data)
+        interfaces = []
+        if ifmgr is not None:
+            interfaces = [name.text for name
+                          in findall_in_data('Name', ifmgr)]
+        groups['interfaces'] = dict(interface_list=interfaces)
+
+    return groups
+
+
+# seconds the boot time worked out from the uptime may drift
+# between runs before the switch is taken to have rebooted
+BOOT_SKEW = 60
+
+
+def get_cached_facts(device, hostname, port, ttl, subsets):
+    """Get the facts of the selected groups, reusing the groups
+    cached in the device snapshot on the controller.  The base
+    group is always fetched and doubles as the probe: the cache is
+    dropped when the switch has rebooted or its hostname changed
+    since the groups were cached, or when they are older than ttl.
+    Modules that change the config clear the snapshot.
+
+    Returns:
+        The facts of each group keyed by group, and the list of
+        groups that came from the cache.
+    """
+    entry = load_snapshot(hostname, port).get('facts')
+
+    # the probe is sent along with the groups that are not cached
+    now = time.time()
+    cached = entry['data'] if entry else {}
+    groups = get_facts(device, ['base'] + [subset for subset in subsets
+                                           if subset not in cached])
+
+    base = groups['base']
+    booted = now - base['uptime']
+    if not entry or now - entry['time'] >= ttl \
+            or abs(booted - entry['booted']) > BOOT_SKEW \
+            or base.get('hostname') != entry['hostname']:
+        entry = dict(time=now, booted=booted,
+                     hostname=base.get('hostname'), data={})
+        groups.update(get_facts(device, [subset for subset in subsets
+                                         if subset not in groups]))
+
+    from_cache = []
+    for subset in subsets:
+        if subset not in groups:
+            groups[subset] = entry['data'][subset]
+            from_cache.append(subset)
+
+    new = [subset for subset in groups
+           if subset != 'base' and subset not in entry['data']]
+    if new:
+        for subset in new:
+            entry['data'][subset] = groups[subset]
+        update_snapshot(hostname, port, 'facts', entry)
+
+    return groups, from_cache
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
+            gather_subset=dict(default=['all'], type='list'),
+            snapshot_ttl=dict(default=0, type='int'),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(default=830, type='int'),
             hostname=dict(required=True),
             username=dict(required=True),
@@ -96,10 +325,17 @@ def main():
         safe_fail(module, msg='There was a problem loading from the pyhpecw7 '
                   + 'module.', error=str(ie))
 
+    try:
+        subsets = get_subsets(module.params['gather_subset'])
+    except ValueError as e:
+        safe_fail(module, msg='unknown fact group {0} in gather_subset,'
+                  ' choose from all, {1}'.format(e, ', '.join(FACT_SUBSETS)))
+
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
 
     device_args = dict(host=hostname, username=username,
                        password=password, port=port)
@@ -112,15 +348,25 @@ def main():
         safe_fail(module, device, msg=str(e),
                   descr='error opening connection to device')
 
+    from_cache = []
     try:
-        facts = Facts(device)
+        if module.params['snapshot_ttl']:
+            groups, from_cache = get_cached_facts(
+                device, hostname, port, module.params['snapshot_ttl'],
+                subsets)
+        else:
+            groups = get_facts(device, subsets)
     except PYHPError as e:
         safe_fail(module, device, msg=str(e),
                   descr='error collecting facts')
 
-    hpfacts = facts.facts
+    hpfacts = OrderedDict()
+    for subset in subsets:
+        hpfacts.update(groups[subset])
+    if 'uptime' in hpfacts:
+        hpfacts['uptime'] = format_uptime(hpfacts['uptime'])
 
-    safe_exit(module, device, ansible_facts=hpfacts)
+    safe_exit(module, device, ansible_facts=hpfacts, cached=from_cache)
 
 from ansible.module_utils.basic import *
 main()
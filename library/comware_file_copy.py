@@ -12,6 +12,11 @@ category: System (RW)
 notes:
     - If the remote directory doesn't exist, it will be automatically
       created.
+    - With transfer=sftp, a partial remote file is only resumed when
+      its md5 sum matches the start of the local file.  Otherwise it
+      is overwritten.
+    - After a transfer, the module returns bytes_sent, elapsed (seconds)
+      and throughput (bytes per second), taken over all attempts.
 options:
     file:
         description:
@@ -30,6 +35,40 @@ options:
         default: flash:/<file>
         choices: []
         aliases: []
+    transfer:
+        description:
+            - Protocol used to copy the file.  sftp sends the file in
+              chunks, resumes a partial copy left on the switch by an
+              earlier attempt, and retries on connection errors.  It
+              requires the SFTP server to be enabled on the switch.
+        required: false
+        default: scp
+        choices: ['scp', 'sftp']
+        aliases: []
+    chunk_size:
+        description:
+            - Number of bytes read from the local file and written to
+              the switch at a time when transfer is sftp
+        required: false
+        default: 1048576
+        choices: []
+        aliases: []
+    retries:
+        description:
+            - Number of times an interrupted sftp transfer is resumed
+              before the module fails
+        required: false
+        default: 2
+        choices: []
+        aliases: []
+    timeout:
+        description:
+            - NETCONF timeout in seconds.  The md5 sum of large files
+              is computed on the switch and may need more than the default.
+        required: false
+        default: 120
+        choices: []
+        aliases: []
     hostname:
         description:
             - IP Address or hostname of the Comware v7 device that has
@@ -52,6 +91,17 @@ options:
         default: null
         choices: []
         aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -67,14 +117,23 @@ EXAMPLES = """
 # copy file
 - comware_file_copy: file=/usr/smallfile remote_path=flash:/otherfile username={{ username }} password={{ password }} hostname={{ inventory_hostname }}
 
+# copy a large image over sftp, resuming an interrupted copy
+- comware_file_copy: file=/usr/images/5930-cmw710-system.bin transfer=sftp timeout=300 username={{ username }} password={{ password }} hostname={{ inventory_hostname }}
+
 """
 import socket
+import os
+import time
+import hashlib
 
+from ansible.module_utils.comware_cache import resolve_hostname
 try:
     HAS_PYHP = True
     from pyhpecw7.comware import HPCOM7
     from pyhpecw7.features.file_copy import FileCopy
+    from pyhpecw7.features.errors import FileNotEnoughSpaceError
     from pyhpecw7.errors import *
+    import paramiko
 except ImportError as ie:
     HAS_PYHP = False
 
@@ -91,14 +150,112 @@ def safe_exit(module, device=None, **kwargs):
     module.exit_json(**kwargs)
 
 
+def local_md5(path, length=None, blocksize=2**20):
+    """Return the md5 sum of the first length bytes of a local
+    file, or of the whole file, read blocksize bytes at a time.
+    """
+    md5 = hashlib.md5()
+    remaining = length
+    with open(path, 'rb') as src_file:
+        while remaining is None or remaining > 0:
+            size = blocksize if remaining is None \
+                else min(blocksize, remaining)
+            buf = src_file.read(size)
+            if not buf:
+                break
+            md5.update(buf)
+            if remaining is not None:
+                remaining -= len(buf)
+    return md5.hexdigest()
+
+
+def get_remote_md5(file_copy):
+    """Return the md5 sum of the remote file, or None if it
+    doesn't exist.
+    """
+    try:
+        return file_copy._get_remote_md5()
+    except NCError:
+        return None
+
+
+def sftp_path(dst):
+    """Map a Comware file path such as flash:/dir/file to the
+    path the SFTP server on the switch uses for it.
+    """
+    return '/' + dst.split(':/', 1)[-1].lstrip('/')
+
+
+def sftp_transfer(device, file_copy, chunk_size, progress):
+    """Copy the local file to the switch over SFTP chunk_size bytes
+    at a time.  A partial remote file is appended to when its md5 sum
+    matches the same number of bytes at the start of the local file,
+    and only the bytes not on the switch yet need to fit on it.
+
+    The offset the first attempt started from and the bytes sent,
+    summed over attempts, are kept in the progress dictionary, so
+    they are known even when an attempt fails.
+    """
+    src_size = os.path.getsize(file_copy.src)
+    path = sftp_path(file_copy.dst)
+
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    ssh.connect(hostname=device.host,
+                username=device.username,
+                password=device.password,
+                port=file_copy.port,
+                allow_agent=False,
+                look_for_keys=False)
+    try:
+        sftp = ssh.open_sftp()
+        try:
+            remote_size = sftp.stat(path).st_size
+        except IOError:
+            remote_size = 0
+
+        offset = 0
+        if 0 < remote_size < src_size:
+            if get_remote_md5(file_copy) == local_md5(file_copy.src,
+                                                      remote_size):
+                offset = remote_size
+        progress.setdefault('resumed_from', offset)
+
+        flash_size = file_copy._get_flash_size()
+        if src_size - offset > flash_size:
+            raise FileNotEnoughSpaceError(file_copy.src, src_size - offset,
+                                          flash_size)
+
+        with open(file_copy.src, 'rb') as src_file:
+            src_file.seek(offset)
+            remote_file = sftp.open(path, 'ab' if offset else 'wb')
+            try:
+                while True:
+                    chunk = src_file.read(chunk_size)
+                    if not chunk:
+                        break
+                    remote_file.write(chunk)
+                    progress['bytes_sent'] += len(chunk)
+            finally:
+                remote_file.close()
+        sftp.close()
+    finally:
+        ssh.close()
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
             file=dict(required=True),
             remote_path=dict(),
+            transfer=dict(choices=['scp', 'sftp'], default='scp'),
+            chunk_size=dict(type='int', default=1048576),
+            retries=dict(type='int', default=2),
+            timeout=dict(type='int', default=120),
             hostname=dict(required=True),
             username=dict(required=True),
             password=dict(required=True),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(type='int', default=830)
         ),
         supports_check_mode=False
@@ -108,18 +265,25 @@ def main():
         safe_fail(module, msg='There was a problem loading from the pyhpecw7 '
                   + 'module.', error=str(ie))
 
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
 
     device = HPCOM7(host=hostname, username=username,
-                    password=password, port=port, timeout=120)
+                    password=password, port=port,
+                    timeout=module.params['timeout'])
 
     src = module.params.get('file')
     dst = module.params.get('remote_path')
+    transfer = module.params['transfer']
 
     changed = False
+    attempts = 1
+    resumed_from = 0
+    bytes_sent = 0
+    elapsed = 0
 
     try:
         device.open()
@@ -127,21 +291,91 @@ def main():
         safe_fail(module, device, msg=str(e),
                   descr='Error opening connection to device.')
 
-    try:
-        file_copy = FileCopy(device, src, dst)
-        if not file_copy.file_already_exists():
+    if transfer == 'scp':
+        try:
+            file_copy = FileCopy(device, src, dst)
+            if not file_copy.file_already_exists():
+                if not file_copy.remote_dir_exists:
+                    file_copy.create_remote_dir()
+                start = time.time()
+                file_copy.transfer_file()
+                elapsed = time.time() - start
+                bytes_sent = os.path.getsize(file_copy.src)
+                changed = True
+        except PYHPError as fe:
+            safe_fail(module, device, msg=str(fe),
+                      descr='Error transferring file.')
+    else:
+        try:
+            file_copy = FileCopy(device, src, dst)
             if not file_copy.remote_dir_exists:
                 file_copy.create_remote_dir()
-            file_copy.transfer_file()
+        except PYHPError as fe:
+            safe_fail(module, device, msg=str(fe),
+                      descr='Error transferring file.')
+
+        # the local file is hashed once here, and the free space is
+        # checked by sftp_transfer against what is left to send
+        try:
+            src_hash = local_md5(file_copy.src)
+        except IOError as e:
+            safe_fail(module, device, msg=str(e),
+                      descr='Error reading local file.')
+        try:
+            dst_hash = get_remote_md5(file_copy)
+        except PYHPError as e:
+            safe_fail(module, device, msg=str(e),
+                      descr='Error getting md5 sum of remote file.')
+
+        if dst_hash != src_hash:
+            # every attempt resumes from what the previous
+            # attempts left on the switch
+            attempts = 0
+            progress = dict(bytes_sent=0)
+            start = time.time()
+            while True:
+                attempts += 1
+                try:
+                    sftp_transfer(device, file_copy,
+                                  module.params['chunk_size'], progress)
+                    break
+                except FileNotEnoughSpaceError as e:
+                    safe_fail(module, device, msg=str(e),
+                              descr='Error transferring file.',
+                              attempts=attempts)
+                except (IOError, socket.error,
+                        paramiko.SSHException, PYHPError) as e:
+                    if attempts > module.params['retries']:
+                        safe_fail(module, device, msg=str(e),
+                                  descr='Error transferring file.',
+                                  attempts=attempts)
+            elapsed = time.time() - start
+            resumed_from = progress.get('resumed_from', 0)
+            bytes_sent = progress['bytes_sent']
             changed = True
-    except PYHPError as fe:
-        safe_fail(module, device, msg=str(fe),
-                  descr='Error transferring file.')
+
+            try:
+                dst_hash = get_remote_md5(file_copy)
+            except PYHPError as e:
+                safe_fail(module, device, msg=str(e),
+                          descr='Error getting md5 sum of remote file.')
+            if src_hash != dst_hash:
+                safe_fail(module, device, src_hash=src_hash,
+                          dst_hash=dst_hash,
+                          msg='md5 sum of the remote file does not match'
+                          + ' the local file')
 
     results = {}
     results['source_file'] = file_copy.src
     results['destination_file'] = file_copy.dst
     results['changed'] = changed
+    if changed:
+        results['attempts'] = attempts
+        results['resumed_from'] = resumed_from
+        results['bytes_sent'] = bytes_sent
+        results['elapsed'] = round(elapsed, 2)
+        if elapsed:
+            results['throughput'] = int(bytes_sent / elapsed)
 
     safe_exit(module, device, **results)
 
@@ -10,12 +10,17 @@ description:
 version_added: 1.8
 category: System (RW)
 notes:
-    - Check mode copies config file to device and still generates diffs
+    - Check mode copies config file to device and still generates diffs,
+      unless diff_engine is local
     - diff_file must be specified to write diffs to a file, otherwise,
       only summarized diffs are returned from the module
     - commit_changes must be true to apply changes
     - this module does an automatic backup of the existing config
       to the filename flash:/safety_file.cfg
+    - with mode=incremental, the backup is saved before the commands
+      are applied, and flash:/startup.cfg is only saved once the
+      running config matches the config file
+    - mode, commands and active_files report how the config was applied
     - this module does an auto save to flash:/startup.cfg upon completion
     - config_file MUST be a valid FULL config file for a given device.
 options:
@@ -37,6 +42,40 @@ options:
         default: null
         choices: ['true', 'false']
         aliases: []
+    diff_format:
+        description:
+            - Format of diff_file.  text writes the summary and the full
+              diffs returned by the switch.  json writes the removed and
+              added lines grouped by config section, e.g.
+              interface FortyGigE1/0/1, vlan 10 or global.
+        required: false
+        default: text
+        choices: ['text', 'json']
+        aliases: []
+    mode:
+        description:
+            - replace activates the whole config file with the rollback
+              feature.  incremental applies only the lines that differ,
+              taken from display diff, as CLI commands in their views.
+              It falls back to replace when a changed line cannot be
+              placed in its view, or when differences remain after the
+              commands were applied.
+        required: false
+        default: replace
+        choices: ['replace', 'incremental']
+        aliases: []
+    diff_engine:
+        description:
+            - switch compares the config file to the running config with
+              display diff on the switch, after copying the file to it.
+              local fetches the running config once and compares it on
+              the Ansible host, so the file is only copied to the switch
+              when it is applied with a full replace, and nothing is
+              replaced when there are no differences.
+        required: false
+        default: switch
+        choices: ['switch', 'local']
+        aliases: []
     diff_file:
         description:
             - File that will be used to store the diffs.  Relative path is
@@ -45,6 +84,17 @@ options:
         default: null
         choices: []
         aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -87,10 +137,33 @@ EXAMPLES = """
     password={{ password }}
     hostname={{ inventory_hostname }}
 
+# preview the changes without copying the file to the switch
+- comware_install_config:
+    config_file='/home/ansible/projects/pyhpecw7comware/newconfig.cfg'
+    diff_file='/home/ansible/projects/pyhpecw7comware/diffs.json'
+    diff_format=json
+    diff_engine=local
+    commit_changes=false
+    username={{ username }}
+    password={{ password }}
+    hostname={{ inventory_hostname }}
+
+# apply only the lines that differ from the running config
+- comware_install_config:
+    config_file='/home/ansible/projects/pyhpecw7comware/newconfig.cfg'
+    commit_changes=true
+    mode=incremental
+    username={{ username }}
+    password={{ password }}
+    hostname={{ inventory_hostname }}
+
 """
 
-import socket
 import os
+import json
+from collections import OrderedDict
+from ansible.module_utils.comware_cache import (
+    resolve_hostname, invalidate_snapshot)
 try:
     HAS_PYHP = True
     from pyhpecw7.features.config import Config
@@ -102,21 +175,288 @@ except ImportError as ie:
     HAS_PYHP = False
 
 
-def write_diffs(diff_file, diffs, full_diffs):
+def write_diffs(diff_file, diffs, full_diffs, diff_format='text'):
 
     with open(diff_file, 'w+') as diff:
+        if diff_format == 'json':
+            json.dump(get_diff_sections(full_diffs), diff, indent=4)
+            diff.write('\n')
+            return
+
         diff.write("#######################################\n")
         diff.write('########## SUMMARY OF DIFFS ###########\n')
         diff.write("#######################################\n")
         diff.write('\n\n')
-        diff.write('\n'.join(diffs))
-        diff.write('\n\n\n')
+        for line in diffs:
+            diff.write(line + '\n')
+        diff.write('\n\n')
         diff.write("#######################################\n")
         diff.write('FULL DIFFS AS RETURNED BACK FROM SWITCH\n')
         diff.write("#######################################\n")
         diff.write('\n\n')
-        diff.write('\n'.join(full_diffs))
-        diff.write('\n')
+        for line in full_diffs:
+            diff.write(line + '\n')
+
+
+def negate(command):
+    if command.startswith('undo '):
+        return command[5:]
+    return 'undo ' + command
+
+
+def parse_config(lines):
+    """Parse a Comware config into a tree.  Each level is an OrderedDict
+    keyed by line, holding the indent of the line and the level of the
+    lines in its view.  Lines before the first '#', such as the prompt
+    and command echoed by the switch, are skipped.
+    """
+    root = OrderedDict()
+    # levels of the views the current line can be nested in
+    views = []
+    started = False
+    for line in lines:
+        line = line.rstrip()
+        text = line.strip()
+        if text.startswith('#'):
+            started = True
+            views = []
+            continue
+        if not started or not text or text == 'return':
+            continue
+
+        indent = len(line) - len(line.lstrip(' '))
+        views = [view for view in views if view[0] < indent]
+        level = views[-1][1] if views else root
+        node = level.setdefault(text, (indent, OrderedDict()))
+        views.append((indent, node[1]))
+
+    return root
+
+
+def config_lines(mark, text, indent, level):
+    lines = [mark + ' ' * indent + text]
+    for child, (child_indent, child_level) in level.items():
+        lines.extend(config_lines(mark, child, child_indent, child_level))
+    return lines
+
+
+def diff_config(running, new, top=True):
+    """Return the lines of a unified diff from the running config tree
+    to the new one, in the format of display diff.  Changed lines are
+    preceded by the views they are in, and at the top level by '#'.
+    """
+    blocks = []
+    for text, (indent, level) in running.items():
+        if text not in new:
+            blocks.append(config_lines('-', text, indent, level))
+    for text, (indent, level) in new.items():
+        if text not in running:
+            blocks.append(config_lines('+', text, indent, level))
+        else:
+            lines = diff_config(running[text][1], level, top=False)
+            if lines:
+                blocks.append([' ' + ' ' * indent + text] + lines)
+
+    lines = []
+    for block in blocks:
+        if top:
+            lines.append(' #')
+        lines.extend(block)
+    return lines
+
+
+def summarize_diffs(full_diffs):
+    """Return the summary of the lines to apply and to remove,
+    as Config.compare_config() does for display diff.
+    """
+    new_cfg = []
+    current_cfg = []
+    for line in full_diffs:
+        if line.startswith('---') or line.startswith('+++'):
+            continue
+        if line.strip().startswith('-') and '#' not in line:
+            current_cfg.append(line.strip('-').strip())
+        elif line.strip().startswith('+') and '#' not in line:
+            new_cfg.append(line.strip('+').strip())
+
+    diffs = ['+' + each for each in set(new_cfg).difference(current_cfg)]
+    diffs.extend('-' + each for each in set(current_cfg).difference(new_cfg))
+    return diffs
+
+
+def get_diffs(device, config_file, engine):
+    """Return the summary and full diffs between the running config
+    and the config file, computed by the switch with display diff or
+    locally from the running config.
+    """
+    if engine == 'switch':
+        # a Config object only asks the switch for the diff once
+        return Config(device, config_file).compare_config()
+
+    running = device.cli_display('display current-configuration')
+    with open(config_file) as new_file:
+        new = parse_config(new_file)
+    full_diffs = ['--- Current configuration', '+++ ' + config_file]
+    full_diffs.extend(diff_config(parse_config(running.split('\n')), new))
+    return summarize_diffs(full_diffs), full_diffs
+
+
+def upload_config(device, config_file):
+    copy = FileCopy(device,
+                    src=config_file,
+                    dst='flash:/{0}'.format(os.path.basename(config_file)))
+    if not copy.file_already_exists():
+        copy.transfer_file()
+
+
+def get_diff_changes(full_diffs, strict=True):
+    """Return the lines removed from and added to the running config
+    in the output of display diff, each with the views it is in and
+    its indent, or None when a changed line cannot be placed in its
+    view.  With strict set to False, such lines are returned with
+    None as their views.
+    """
+    changes = []
+    # views the current line is nested in, as (indent, line), or None
+    # from the start of a hunk until a line at a known level is seen
+    views = []
+    for diff_line in full_diffs:
+        diff_line = diff_line.rstrip()
+        if diff_line.startswith('---') or diff_line.startswith('+++'):
+            continue
+        if diff_line.startswith('@@'):
+            # the views of the first lines of a hunk are not known
+            # until a line at the top level has been seen
+            views = None
+            continue
+        if not diff_line or diff_line[0] not in ' +-':
+            continue
+
+        mark, line = diff_line[0], diff_line[1:]
+        text = line.strip()
+        if not text or text == 'return':
+            continue
+        if text.startswith('#'):
+            views = []
+            continue
+
+        # view headers start at column 0, while both the lines in a
+        # view and global commands after a '#' are indented
+        indent = len(line) - len(line.lstrip(' '))
+        if indent == 0:
+            views = []
+        elif views is not None:
+            views = [view for view in views if view[0] < indent]
+        if views is None:
+            if mark != ' ':
+                if strict:
+                    return None
+                changes.append((mark, None, text, indent))
+            continue
+
+        path = tuple(view[1] for view in views)
+        if mark != ' ':
+            changes.append((mark, path, text, indent))
+        views = views + [(indent, text)]
+
+    return changes
+
+
+def get_diff_sections(full_diffs):
+    """Group the lines removed and added by display diff by the config
+    section they are in: the views they are nested in, such as
+    'interface FortyGigE1/0/1', 'global' for global commands, or
+    'unknown' when the view is not part of the diff context.  Lines
+    that are both removed and added in a section only moved, and
+    are left out.
+    """
+    sections = OrderedDict()
+    for mark, path, text, indent in get_diff_changes(full_diffs,
+                                                     strict=False):
+        if path is None:
+            section = 'unknown'
+        elif path:
+            section = ' / '.join(path)
+        elif indent == 0:
+            section = text
+        else:
+            section = 'global'
+
+        if section not in sections:
+            sections[section] = dict(removed=[], added=[])
+        if mark == '-':
+            sections[section]['removed'].append(text)
+        else:
+            sections[section]['added'].append(text)
+
+    for section in sections.keys():
+        removed = sections[section]['removed']
+        added = sections[section]['added']
+        moved = set(removed).intersection(added)
+        if moved:
+            removed[:] = [text for text in removed if text not in moved]
+            added[:] = [text for text in added if text not in moved]
+            if not (removed or added):
+                del sections[section]
+
+    return sections
+
+
+def get_incremental_commands(full_diffs):
+    """Return the CLI commands that turn the running config into the
+    config file, or None when the diff cannot be expressed as commands.
+    """
+    changes = get_diff_changes(full_diffs)
+    if changes is None:
+        return None
+
+    removed = set()
+    added = set()
+    # views that are entered to add lines to them, and the first word
+    # of each line added other than a view header, as in 'description'
+    entered = set()
+    keywords = set()
+    for mark, path, text, indent in changes:
+        if mark == '-':
+            removed.add(path + (text,))
+        else:
+            added.add(path + (text,))
+            entered.update(path[:i] for i in range(1, len(path) + 1))
+            if indent:
+                keywords.add(path + (text.split()[0],))
+
+    ordered = []
+    for mark, path, text, indent in changes:
+        if mark == '-':
+            # lines in a view that is removed go away with it, lines
+            # that only moved stay as they are, and values set again
+            # in the same view are overwritten by the new line
+            if any(path[:i] in removed for i in range(1, len(path) + 1)):
+                continue
+            if path + (text,) in added:
+                continue
+            if indent and path + (text.split()[0],) in keywords:
+                continue
+            ordered.append((0, path, negate(text)))
+        else:
+            if path + (text,) in removed or path + (text,) in entered:
+                continue
+            ordered.append((1, path, text))
+
+    # removals go first, so an undo never clears a value just set
+    ordered.sort(key=lambda change: change[0])
+
+    commands = []
+    current = ()
+    for order, path, command in ordered:
+        if path != current:
+            commands.extend(['quit'] * len(current))
+            commands.extend(path)
+            current = path
+        commands.append(command)
+    commands.extend(['quit'] * len(current))
+
+    return commands
 
 
 def safe_fail(module, device=None, **kwargs):
@@ -137,6 +477,10 @@ def main():
             config_file=dict(required=True, type='str'),
             diff_file=dict(required=False, type='str'),
             commit_changes=dict(required=True, choices=BOOLEANS, type='bool'),
+            mode=dict(choices=['replace', 'incremental'], default='replace'),
+            diff_format=dict(choices=['text', 'json'], default='text'),
+            diff_engine=dict(choices=['switch', 'local'], default='switch'),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(default=830, type='int'),
             hostname=dict(required=True),
             username=dict(required=True),
@@ -152,7 +496,8 @@ def main():
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
 
     device_args = dict(host=hostname, username=username,
                        password=password, port=port)
@@ -162,6 +507,8 @@ def main():
     config_file = module.params['config_file']
     diff_file = module.params['diff_file']
     commit_changes = module.params['commit_changes']
+    mode = module.params['mode']
+    engine = module.params['diff_engine']
 
     changed = False
 
@@ -179,39 +526,104 @@ def main():
 
     if file_exists:
         basename = os.path.basename(config_file)
+        cfg = Config(device, config_file)
+        # the local diff engine only needs the file on the switch
+        # when it is applied with a full replace
+        if engine == 'switch':
+            try:
+                upload_config(device, config_file)
+            except PYHPError as fe:
+                safe_fail(module, device, msg=str(fe),
+                          descr='file transfer error')
+
+    if diff_file or mode == 'incremental' or engine == 'local':
         try:
-            copy = FileCopy(device,
-                            src=config_file,
-                            dst='flash:/{0}'.format(basename))
-            copy.transfer_file()
-            cfg = Config(device, config_file)
-        except PYHPError as fe:
-            safe_fail(module, device, msg=str(fe),
-                      descr='file transfer error')
-
-    if diff_file:
-        diffs, full_diffs = cfg.compare_config()
-        write_diffs(diff_file, diffs, full_diffs)
-    else:
+            diffs, full_diffs = get_diffs(device, config_file, engine)
+        except PYHPError as e:
+            safe_fail(module, device, msg=str(e),
+                      descr='error comparing config')
+        if diff_file:
+            write_diffs(diff_file, diffs, full_diffs,
+                        module.params['diff_format'])
+    if not diff_file:
         diffs = 'None.  diff_file param not set in playbook'
 
-    cfg.build(stage=True)
+    commands = None
+    if mode == 'incremental':
+        commands = get_incremental_commands(full_diffs)
+        if commands is None:
+            mode = 'replace'
+        elif commands:
+            # startup.cfg is only saved once the commands are known
+            # to have produced the config file
+            device.stage_config('safety_file.cfg', 'save')
+            device.stage_config(commands, 'cli_config')
+    if mode == 'replace':
+        if engine == 'switch' or get_diff_changes(full_diffs, strict=False):
+            cfg.build(stage=True)
 
     active_files = {}
     if device.staged:
         active_files = dict(backup='flash:/safety_file.cfg',
                             startup='flash:/startup.cfg',
                             config_applied='flash:/' + basename)
+        if mode == 'incremental' and engine == 'local':
+            active_files.pop('config_applied')
         if module.check_mode:
             safe_exit(module, device, changed=True,
                       active_files=active_files,
                       diffs=diffs,
                       diff_file=diff_file,
-                      config_file=config_file)
+                      config_file=config_file,
+                      mode=mode,
+                      commands=commands)
         else:
-            if commit_changes:
+            if commit_changes and mode == 'incremental':
+                try:
+                    device.execute_staged()
+                except PYHPError as e:
+                    invalidate_snapshot(hostname, port)
+                    safe_fail(module, device, msg=str(e),
+                              descr='error applying commands, the previous'
+                              ' config is saved in flash:/safety_file.cfg',
+                              commands=commands, active_files=active_files)
+                invalidate_snapshot(hostname, port)
+                changed = True
+                try:
+                    remaining, full_diffs = get_diffs(device, config_file,
+                                                      engine)
+                except PYHPError as e:
+                    safe_fail(module, device, msg=str(e),
+                              descr='error comparing config after applying'
+                              ' commands, startup.cfg was not saved',
+                              commands=commands, active_files=active_files)
+                if remaining:
+                    # the commands did not produce the config file, so
+                    # it is applied with a full replace after all, and
+                    # the backup saved before them is kept
+                    mode = 'replace'
+                    device.stage_config(basename, 'rollback')
+                    active_files['config_applied'] = 'flash:/' + basename
+                device.stage_config('startup.cfg', 'save')
+                if mode == 'incremental':
+                    try:
+                        device.execute_staged()
+                    except PYHPError as e:
+                        safe_fail(module, device, msg=str(e),
+                                  descr='error saving startup.cfg',
+                                  commands=commands,
+                                  active_files=active_files)
+
+            if commit_changes and mode == 'replace':
+                if engine == 'local':
+                    try:
+                        upload_config(device, config_file)
+                    except PYHPError as fe:
+                        safe_fail(module, device, msg=str(fe),
+                                  descr='file transfer error')
                 try:
                     switch_response = device.execute_staged()
+                    invalidate_snapshot(hostname, port)
                     # TODO: check of "ok" or errors?
                 except NCError as err:
                     if err.tag == 'operation-failed':
@@ -230,6 +642,8 @@ def main():
     results['commit_changes'] = commit_changes
     results['diff_file'] = diff_file
     results['config_file'] = config_file
+    results['mode'] = mode
+    results['commands'] = commands
 
     safe_exit(module, device, **results)
 
@@ -16,6 +16,14 @@ notes:
       mutually exclusive.
     - If the files are not currently on the device,
       they will be transfered to the device.
+    - With stage set, the module returns the files transfered to and
+      skipped on each switch in staged, and fails if any switch failed.
+      In check mode nothing is copied and changed is returned true.
+      Run it once, e.g. with run_once, and install with a later task.
+    - The boot and system files are hashed locally and copied to the
+      switch at the same time, each over its own SCP channel of one SSH
+      connection.  Their md5 sums on the switch are requested one after
+      another over the NETCONF session.
 options:
     ipe_package:
         description:
@@ -58,8 +66,9 @@ options:
     reboot:
         description:
             - Determine if the reboot should take place
-              after device startup software image is configured
-        required: true
+              after device startup software image is configured.
+              Required unless stage is set.
+        required: false
         default: null
         choices: ['true', 'false', 'yes', 'no']
         aliases: []
@@ -71,6 +80,41 @@ options:
         default: null
         choices: []
         aliases: []
+    stage:
+        description:
+            - If set, the package files are only copied to the switches in
+              stage_hosts, and nothing is installed.  Each file is hashed
+              once, and switches that already hold a file with the same
+              md5 sum are skipped.
+        required: false
+        default: false
+        choices: ['true', 'false', 'yes', 'no']
+        aliases: []
+    stage_hosts:
+        description:
+            - List of switches the files are copied to when stage is set.
+              They are reached with the same username, password and port.
+        required: false
+        default: [<hostname>]
+        choices: []
+        aliases: []
+    workers:
+        description:
+            - Number of switches the files are copied to at the same time
+              when stage is set
+        required: false
+        default: 4
+        choices: []
+        aliases: []
+    rate_limit:
+        description:
+            - Maximum rate in KB/s of each transfer when stage is set.
+              workers times rate_limit bounds the load on the uplink of
+              the Ansible host.  0 does not limit the rate.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     hostname:
         description:
             - IP Address or hostname of the Comware v7 device that has
@@ -93,6 +137,17 @@ options:
         default: null
         choices: []
         aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -110,19 +165,32 @@ EXAMPLE = """
 # Basic Install OS Boot/Sys
 - comware_install_os: reboot=yes boot=/usr/5930-cmw710-boot-e2415.bin system=/usr/5930-cmw710-system-e2415.bin username={{ username }} password={{ password }} hostname={{ inventory_hostname }}
 
+# Stage an IPE on every switch in the play, 8 at a time at 10 MB/s each
+- comware_install_os: ipe_package=/usr/5900_5920_5930-CMW710-E2415.ipe stage=yes stage_hosts={{ play_hosts }} workers=8 rate_limit=10240 username={{ username }} password={{ password }} hostname={{ inventory_hostname }}
+  run_once: true
+
 """
 
 import socket
 import os
 import re
+import time
+import hashlib
+from multiprocessing.pool import ThreadPool
 
+from ansible.module_utils.comware_cache import (
+    resolve_hostname, invalidate_snapshot)
 try:
     HAS_PYHP = True
     from pyhpecw7.comware import HPCOM7
     from pyhpecw7.features.file_copy import FileCopy
     from pyhpecw7.features.install_os import InstallOs
     from pyhpecw7.features.reboot import Reboot
+    from pyhpecw7.features.errors import FileHashMismatchError,\
+        FileNotEnoughSpaceError, FileRemoteDirDoesNotExist, FileTransferError
     from pyhpecw7.errors import *
+    from scp import SCPClient, SCPException
+    import paramiko
 except ImportError as ie:
     HAS_PYHP = False
 
@@ -139,6 +207,211 @@ def safe_exit(module, device=None, **kwargs):
     module.exit_json(**kwargs)
 
 
+def local_md5(path, blocksize=2**20):
+    """Return the md5 sum of a local file, read blocksize
+    bytes at a time.
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as src_file:
+        buf = src_file.read(blocksize)
+        while buf:
+            md5.update(buf)
+            buf = src_file.read(blocksize)
+    return md5.hexdigest()
+
+
+class RateLimit(object):
+    """SCP progress callback that sleeps as needed to keep
+    a transfer at or below rate bytes per second.
+    """
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.start = None
+
+    def __call__(self, filename, size, sent, *args):
+        if self.start is None:
+            self.start = time.time()
+        ahead = sent / self.rate - (time.time() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def in_parallel(funcs):
+    """Call each function in its own thread and return
+    their results in order.
+    """
+    pool = ThreadPool(len(funcs))
+    try:
+        return pool.map(lambda func: func(), funcs)
+    finally:
+        pool.close()
+
+
+def ssh_connect(device, port=22):
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    ssh.connect(hostname=device.host,
+                username=device.username,
+                password=device.password,
+                port=port,
+                allow_agent=False,
+                look_for_keys=False)
+    return ssh
+
+
+def scp_put(transport, file_copy, rate_limit=0):
+    """Copy a file to the switch over a new SCP channel of
+    transport, limited to rate_limit KB/s when set.
+    """
+    progress = RateLimit(rate_limit * 1024) if rate_limit else None
+    scp = SCPClient(transport, progress=progress)
+    try:
+        scp.put(file_copy.src, file_copy.dst)
+    finally:
+        scp.close()
+
+
+def get_remote_md5(file_copy):
+    if not file_copy.remote_dir_exists:
+        return None
+    try:
+        return file_copy._get_remote_md5()
+    except NCError:
+        return None
+
+
+def get_file_hashes(file_copies):
+    """Return the local and remote md5 sums of each file.  The local
+    files are hashed in parallel while the remote sums are requested
+    one after another, as HPCOM7 locks the running datastore around
+    every RPC and one session can't run two of them at once.
+    """
+    pool = ThreadPool(len(file_copies))
+    try:
+        src_hashes = pool.map_async(lambda fc: local_md5(fc.src),
+                                    file_copies)
+        dst_hashes = [get_remote_md5(fc) for fc in file_copies]
+        return zip(src_hashes.get(), dst_hashes)
+    finally:
+        pool.close()
+
+
+def transfer_files(device, file_copies, src_hashes):
+    """Copy the files to the switch at the same time, each over
+    its own SCP channel of one SSH connection, then check their
+    md5 sums against src_hashes one after another on the NETCONF
+    session.
+    """
+    for file_copy in file_copies:
+        if not file_copy.remote_dir_exists:
+            raise FileRemoteDirDoesNotExist(file_copy._remote_dir)
+
+    size = sum(os.path.getsize(fc.src) for fc in file_copies)
+    flash_size = file_copies[0]._get_flash_size()
+    if size > flash_size:
+        raise FileNotEnoughSpaceError(file_copies[0].src, size, flash_size)
+
+    ssh = ssh_connect(device, file_copies[0].port)
+    try:
+        transport = ssh.get_transport()
+        in_parallel([lambda fc=file_copy: scp_put(transport, fc)
+                     for file_copy in file_copies])
+    except (SCPException, paramiko.SSHException, socket.error):
+        raise FileTransferError
+    finally:
+        ssh.close()
+
+    dst_hashes = [get_remote_md5(file_copy) for file_copy in file_copies]
+    for file_copy, src_hash, dst_hash in zip(file_copies, src_hashes,
+                                             dst_hashes):
+        if src_hash != dst_hash:
+            raise FileHashMismatchError(file_copy.src, file_copy.dst,
+                                        src_hash, dst_hash)
+
+
+def stage_host(host, params, images):
+    """Copy the images a switch does not already hold to it.
+
+    images is a list of (local file, remote file, md5 sum) tuples,
+    hashed once for the whole fleet.
+    """
+    result = dict(transfered=[], skipped=[])
+    device = HPCOM7(host=host, username=params['username'],
+                    password=params['password'], port=params['port'],
+                    timeout=150)
+    # any error is reported against the switch it happened on
+    # rather than stopping the transfers to the other switches
+    try:
+        device.open()
+        for src, dst, md5 in images:
+            file_copy = FileCopy(device, src, dst)
+            if not file_copy.remote_dir_exists:
+                file_copy.create_remote_dir()
+            if get_remote_md5(file_copy) == md5:
+                result['skipped'].append(file_copy.dst)
+                continue
+
+            file_copy._enough_space()
+            ssh = ssh_connect(device, file_copy.port)
+            try:
+                scp_put(ssh.get_transport(), file_copy, params['rate_limit'])
+            finally:
+                ssh.close()
+            dst_hash = file_copy._get_remote_md5()
+            if dst_hash != md5:
+                raise FileHashMismatchError(src, file_copy.dst,
+                                            md5, dst_hash)
+            result['transfered'].append(file_copy.dst)
+    except (PYHPError, IOError, socket.error, SCPException,
+            paramiko.SSHException) as e:
+        result['failed'] = str(e) or e.__class__.__name__
+    finally:
+        try:
+            device.close()
+        except (PYHPError, socket.error):
+            pass
+
+    return result
+
+
+def stage_images(module, images):
+    """Copy the images to every switch in stage_hosts on a pool
+    of workers, and exit.  Nothing is installed, and nothing is
+    copied in check mode.
+    """
+    hosts = module.params['stage_hosts'] or [module.params['hostname']]
+    if module.check_mode:
+        safe_exit(module, changed=True, stage_hosts=hosts)
+
+    try:
+        images = [(src, dst, local_md5(src)) for src, dst in images]
+    except IOError as e:
+        safe_fail(module, msg=str(e), descr='Error reading local image.')
+
+    def stage(host):
+        try:
+            address = resolve_hostname(host, module.params['dns_ttl'])
+        except socket.error as e:
+            return dict(transfered=[], skipped=[], failed=str(e))
+        return stage_host(address, module.params, images)
+
+    pool = ThreadPool(max(1, min(module.params['workers'], len(hosts))))
+    try:
+        staged = dict(zip(hosts, pool.map(stage, hosts)))
+    finally:
+        pool.close()
+
+    results = {}
+    results['staged'] = staged
+    results['md5'] = dict((dst, md5) for src, dst, md5 in images)
+    results['changed'] = any(r['transfered'] for r in staged.values())
+    failed = sorted(h for h, r in staged.items() if r.get('failed'))
+    if failed:
+        safe_fail(module, msg='staging failed on ' + ', '.join(failed),
+                  **results)
+    safe_exit(module, **results)
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
@@ -149,13 +422,19 @@ def main():
             delete_ipe=dict(choices=BOOLEANS,
                             type='bool',
                             default=False),
-            reboot=dict(required=True,
-                        choices=BOOLEANS,
+            reboot=dict(choices=BOOLEANS,
                         type='bool'),
             delay=dict(type='str'),
+            stage=dict(choices=BOOLEANS,
+                       type='bool',
+                       default=False),
+            stage_hosts=dict(type='list'),
+            workers=dict(type='int', default=4),
+            rate_limit=dict(type='int', default=0),
             hostname=dict(required=True),
             username=dict(required=True),
             password=dict(required=True),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(type='int', default=830)
         ),
         supports_check_mode=True
@@ -178,7 +457,19 @@ def main():
             module.fail_json(
                 msg='boot and system parameters must be provided if ipe_package is not')
 
-    hostname = socket.gethostbyname(module.params['hostname'])
+    remote_dir = module.params['remote_dir']
+    if module.params['stage']:
+        if ipe_package:
+            local_files = [ipe_package]
+        else:
+            local_files = [boot, system]
+        stage_images(module, [(src, remote_dir + os.path.basename(src))
+                              for src in local_files])
+    if module.params['reboot'] is None:
+        module.fail_json(msg='reboot is required unless stage is set')
+
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
@@ -208,7 +499,6 @@ def main():
 
     existing_boot = existing['startup-primary']['boot']
     existing_system = existing['startup-primary']['system']
-    remote_dir = module.params['remote_dir']
 
     if ipe_package:
         ipe_basename = os.path.basename(ipe_package)
@@ -263,21 +553,30 @@ def main():
             safe_fail(module, device, msg=str(fe),
                       descr='Error preparing system file transfer.')
 
-        if not boot_file_copy.file_already_exists():
-            try:
-                boot_file_copy.transfer_file()
-                transfered = True
-            except PYHPError as fe:
-                safe_fail(module, device, msg=str(fe),
-                          descr='Error transfering boot file.')
-
-        if not system_file_copy.file_already_exists():
+        # the boot and system files are checked and
+        # transfered at the same time
+        file_copies = [boot_file_copy, system_file_copy]
+        try:
+            hashes = get_file_hashes(file_copies)
+        except IOError as e:
+            safe_fail(module, device, msg=str(e),
+                      descr='Error reading boot/system file.')
+        except PYHPError as e:
+            safe_fail(module, device, msg=str(e),
+                      descr='Error getting md5 sum of boot/system file.')
+        to_transfer = []
+        src_hashes = []
+        for file_copy, (src_hash, dst_hash) in zip(file_copies, hashes):
+            if src_hash != dst_hash:
+                to_transfer.append(file_copy)
+                src_hashes.append(src_hash)
+        if to_transfer:
             try:
-                system_file_copy.transfer_file()
+                transfer_files(device, to_transfer, src_hashes)
                 transfered = True
             except PYHPError as fe:
                 safe_fail(module, device, msg=str(fe),
-                          descr='Error transfering system file.')
+                          descr='Error transfering boot/system files.')
 
         if not already_set:
             ios.build(
@@ -301,6 +600,7 @@ def main():
                       end_state=end_state)
         else:
             try:
+                invalidate_snapshot(hostname, port)
                 device.execute_staged()
                 end_state = ios.get_config()
             except PYHPError as e:
@@ -317,6 +617,7 @@ def main():
     if reboot and not delay:
         reboot_attempt = 'yes'
         try:
+            invalidate_snapshot(hostname, port)
             device.reboot()
             changed = True
 
@@ -22,11 +22,28 @@ notes:
     - When state is set to absent, logical interfaces will be removed
       from the switch, while physical interfaces will be "defaulted"
     - Tunnel interface creation and removal is not currently supported.
+    - When interfaces is used, the config of all listed interfaces is
+      read with a single NETCONF get, filtered on their names for up to
+      16 interfaces, and all changes are pushed together.
+      Results are keyed by interface name.
 options:
     name:
         description:
-            - Full name of the interface
-        required: true
+            - Full name of the interface.  Mutually exclusive
+              with interfaces.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+    interfaces:
+        description:
+            - List of interfaces to configure in a single run.  Each entry
+              is either a dictionary with the key name and any of admin,
+              description, type, duplex and speed, or just an interface
+              name.  admin, description, type, duplex and speed, if set,
+              are used for every entry that does not define its own.
+              Mutually exclusive with name.
+        required: false
         default: null
         choices: []
         aliases: []
@@ -72,6 +89,19 @@ options:
         default: present
         choices: ['present', 'absent', 'default']
         aliases: []
+    end_state:
+        description:
+            - How end_state is reported after changes are committed.
+              fetched reads the config back from the switch.  computed
+              applies the committed changes to the existing config
+              without another read, so values the switch fills in on
+              its own are not included.  verified does both and fails
+              if the fetched config does not match the computed one.
+              none skips end_state.
+        required: false
+        default: fetched
+        choices: ['fetched', 'computed', 'verified', 'none']
+        aliases: []
     hostname:
         description:
             - IP Address or hostname of the Comware v7 device that has
@@ -94,6 +124,17 @@ options:
         default: null
         choices: []
         aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - The Comware port used to connect to the switch
@@ -107,16 +148,32 @@ EXAMPLE = """
 # Basic Ethernet config
 - comware_interface: name=FortyGigE1/0/5 admin=up description=mydesc duplex=auto speed=40000 username={{ username }} password={{ password }} hostname={{ inventory_hostname }}
 
+# Admin down several interfaces in one run
+- comware_interface:
+    interfaces:
+      - FortyGigE1/0/1
+      - FortyGigE1/0/2
+      - name: FortyGigE1/0/3
+        description: uplink
+    admin: down
+    username: "{{ username }}"
+    password: "{{ password }}"
+    hostname: "{{ inventory_hostname }}"
+
 """
 
-import socket
 
+from ansible.module_utils.comware_cache import (
+    resolve_hostname, invalidate_snapshot)
 try:
     HAS_PYHP = True
     from pyhpecw7.comware import HPCOM7
     from pyhpecw7.features.interface import Interface
-    from pyhpecw7.features.errors import InterfaceError
+    from pyhpecw7.features.vlan import Vlan
+    from pyhpecw7.features.errors import InterfaceError,\
+        InterfaceParamsError, InterfaceVlanMustExist
     from pyhpecw7.errors import *
+    from pyhpecw7.utils.xml.lib import *
 except ImportError as ie:
     HAS_PYHP = False
 
@@ -133,10 +190,333 @@ def safe_exit(module, device=None, **kwargs):
     module.exit_json(**kwargs)
 
 
+def end_state_mismatch(computed, fetched):
+    """Return True if the fetched end state does not match
+    the computed one on the keys the computed one sets.
+    """
+    if bool(computed) != bool(fetched):
+        return True
+    return any(fetched.get(k) != v for k, v in computed.iteritems())
+
+
+# above this many interfaces the whole Ifmgr table is read instead
+# of a subtree filtered on each name
+IFACE_FILTER_MAX = 16
+
+
+def normalize_iface_name(name):
+    """Return the full interface name pyhpecw7's Interface uses
+    for name, without reading anything from the device.
+    """
+    return Interface.__new__(Interface)._iface_type(name)[0]
+
+
+def get_iface_table(device, names=None):
+    """Get the config of the named interfaces, or of every interface
+    on the switch when names is None or longer than IFACE_FILTER_MAX,
+    with one NETCONF get.
+
+    Returns:
+        A dictionary of interface XML rows keyed by interface name.
+    """
+    E = data_element_maker()
+
+    def iface_row(name=None):
+        return E.Interface(
+            E.IfIndex(),
+            E.Name(name) if name else E.Name(),
+            E.ifType(),
+            E.PortLayer(),
+            E.AdminStatus(),
+            E.ConfigSpeed(),
+            E.ConfigDuplex(),
+            E.Description()
+        )
+
+    if names is None or len(names) > IFACE_FILTER_MAX:
+        rows = [iface_row()]
+    else:
+        rows = [iface_row(name) for name in names]
+
+    top = E.top(
+        E.Ifmgr(
+            E.Interfaces(*rows)
+        )
+    )
+
+    nc_get_reply = device.get(('subtree', top))
+
+    table = {}
+    for row in findall_in_data('Interface', nc_get_reply.data_ele):
+        name = find_in_data('Name', row)
+        if name is not None:
+            table[name.text] = row
+
+    return table
+
+
+if HAS_PYHP:
+    class TableInterface(Interface):
+        """Interface that reads its index, type and config from a table
+        returned by get_iface_table() instead of querying the device.
+        """
+        def __init__(self, device, interface_name, iface_table,
+                     vlan_ids=None):
+            self.iface_table = iface_table
+            self.vlan_ids = vlan_ids
+            super(TableInterface, self).__init__(device, interface_name)
+
+        def _row(self):
+            return self.iface_table.get(self.interface_name)
+
+        def _get_iface_index(self):
+            row = self._row()
+            if row is None:
+                return ''
+            return find_in_data(self._iface_index_name, row).text
+
+        def _is_ethernet_is_routed(self):
+            row = self._row()
+            if row is None:
+                return False, False
+            if_type = find_in_data('ifType', row)
+            port_layer = find_in_data('PortLayer', row)
+            is_ethernet = if_type is not None and if_type.text == '6'
+            is_routed = port_layer is not None and port_layer.text == '2'
+            return is_ethernet, is_routed
+
+        def get_config(self):
+            row = self._row()
+            if row is None:
+                return {}
+            return data_elem_to_dict(row, self._key_map,
+                                     value_map=self._value_map)
+
+        def param_check(self, **params):
+            """Same checks as Interface.param_check, but the VLAN of
+            a Vlan-interface is looked up in vlan_ids.
+            """
+            if self.iface_type != 'Vlan-interface' or self.vlan_ids is None:
+                return super(TableInterface, self).param_check(**params)
+
+            if not self.is_ethernet:
+                param_names = [k for k in ('speed', 'duplex')
+                               if params.get(k)]
+                if param_names:
+                    raise InterfaceParamsError(self.interface_name,
+                                               param_names)
+
+            number = self.interface_name.split('Vlan-interface')[1]
+            if number not in self.vlan_ids:
+                raise InterfaceVlanMustExist(self.interface_name, number)
+
+
+def get_row_parent(config):
+    """Return the element holding the Interface rows of
+    a staged config object.
+    """
+    for ele in config.iter():
+        if ele.tag.split('}')[-1] == 'Interface':
+            return ele.getparent()
+
+
+def get_row_path(row_parent):
+    path = []
+    while row_parent is not None:
+        path.insert(0, (row_parent.tag, dict(row_parent.attrib)))
+        row_parent = row_parent.getparent()
+    return path
+
+
+def merge_staged(device):
+    """Merge consecutive staged objects of the same type that
+    configure rows of the same table into a single object.
+    """
+    merged = []
+    for item in device.staged:
+        if merged and merged[-1]['cfg_type'] == item['cfg_type']:
+            rows = get_row_parent(merged[-1]['config'])
+            new_rows = get_row_parent(item['config'])
+            if rows is not None and new_rows is not None\
+                    and get_row_path(rows) == get_row_path(new_rows):
+                for row in list(new_rows):
+                    rows.append(row)
+                continue
+        merged.append(item)
+
+    device.staged[:] = merged
+
+
+def get_iface_args(interfaces, params):
+    """Build the list of per-interface argument dictionaries
+    from the interfaces param.
+    """
+    attrs = ('admin', 'description', 'type', 'duplex', 'speed')
+
+    iface_args = []
+    for entry in interfaces:
+        if not isinstance(entry, dict):
+            entry = dict(name=entry)
+        args = dict((k, entry.get(k, params.get(k))) for k in attrs)
+        args = dict((k, str(v)) for k, v in args.iteritems()
+                    if v is not None)
+        iface_args.append((str(entry.get('name')), args))
+
+    return iface_args
+
+
+def bulk_interfaces(module, device):
+    """Configure every interface in the interfaces param with one
+    read of the interface table and one staged commit.
+    """
+    state = module.params['state']
+    end_state_mode = module.params['end_state']
+    iface_args = [(normalize_iface_name(name), args) for name, args
+                  in get_iface_args(module.params['interfaces'],
+                                    module.params)]
+    names = [name for name, args in iface_args]
+
+    for name, args in iface_args:
+        if state == 'present' and args.get('type'):
+            if args.get('admin') or args.get('description')\
+                    or args.get('duplex') or args.get('speed'):
+                safe_fail(module, device, name=name,
+                          msg='The type parameter is incompatible with:'
+                              '\nadmin, description, duplex, speed.'
+                              '\nPlease configure type first by itself,'
+                              '\nthen run again.')
+
+    try:
+        table = get_iface_table(device, names)
+        vlan_ids = None
+        if any(name.startswith('Vlan-interface') for name in names):
+            vlan_ids = set(Vlan(device).get_vlan_list())
+    except PYHPError as e:
+        safe_fail(module, device, msg=str(e),
+                  descr='Error getting existing config.')
+
+    interfaces = []
+    for name, args in iface_args:
+        try:
+            interface = TableInterface(device, name, table, vlan_ids)
+            interface.param_check(**args)
+        except PYHPError as e:
+            safe_fail(module, device, name=name, msg=str(e),
+                      descr='There was problem with the supplied parameters.')
+        interfaces.append((interface, args))
+
+    changed = False
+    if state == 'present':
+        to_create = [interface for interface, args in interfaces
+                     if not interface.iface_exists]
+        if to_create:
+            try:
+                for interface in to_create:
+                    interface.create_logical()
+                invalidate_snapshot(device.host, device.port,
+                                    ['interface_types', 'facts'])
+                changed = True
+                table.update(get_iface_table(device, names))
+                for interface in to_create:
+                    interface.update()
+            except PYHPError as e:
+                safe_fail(module, device,
+                          msg='Exception message ' + str(e),
+                          descr='There was a problem creating'
+                          + ' the logical interface.')
+
+    proposed = {}
+    existing = {}
+    computed = {}
+    for interface, args in interfaces:
+        name = interface.interface_name
+        proposed[name] = args
+        existing[name] = interface.get_config()
+        computed[name] = existing[name]
+
+        if state == 'present':
+            delta = dict(set(args.iteritems()).difference(
+                existing[name].iteritems()))
+            if delta:
+                interface.build(stage=True, **delta)
+            computed[name] = dict(existing[name], **delta)
+        elif state == 'default':
+            defaults = interface.get_default_config()
+            delta = dict(set(existing[name].iteritems()).difference(
+                defaults.iteritems()))
+            if delta:
+                interface.default(stage=True)
+            computed[name] = defaults
+        elif state == 'absent':
+            if interface.iface_exists:
+                if interface.is_ethernet:
+                    defaults = interface.get_default_config()
+                    delta = dict(set(existing[name].iteritems()).difference(
+                        defaults.iteritems()))
+                    if delta:
+                        interface.default(stage=True)
+                    computed[name] = defaults
+                else:
+                    interface.remove_logical(stage=True)
+                    computed[name] = {}
+
+    merge_staged(device)
+
+    commands = None
+    end_state = existing
+
+    if device.staged:
+        commands = device.staged_to_string()
+        if module.check_mode:
+            safe_exit(module, device, changed=True,
+                      commands=commands)
+        else:
+            try:
+                device.execute_staged()
+                invalidate_snapshot(device.host, device.port,
+                                    ['interface_types', 'facts'])
+                if end_state_mode in ['fetched', 'verified']:
+                    table = get_iface_table(device, names)
+                    end_state = dict((interface.interface_name,
+                                      TableInterface(device,
+                                                     interface.interface_name,
+                                                     table).get_config())
+                                     for interface, args in interfaces)
+            except PYHPError as e:
+                safe_fail(module, device, msg=str(e),
+                          descr='Error on device execution.')
+            changed = True
+
+            if end_state_mode == 'computed':
+                end_state = computed
+            elif end_state_mode == 'verified':
+                mismatched = [name for name in computed
+                              if end_state_mismatch(computed[name],
+                                                    end_state[name])]
+                if mismatched:
+                    safe_fail(module, device, interfaces=mismatched,
+                              msg='end state does not match the computed'
+                              + ' end state', computed=computed,
+                              end_state=end_state)
+            elif end_state_mode == 'none':
+                end_state = None
+
+    results = {}
+    results['proposed'] = proposed
+    results['existing'] = existing
+    results['state'] = state
+    results['commands'] = commands
+    results['changed'] = changed
+    results['end_state'] = end_state
+
+    safe_exit(module, device, **results)
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            name=dict(required=True),
+            name=dict(required=False),
+            interfaces=dict(required=False, type='list'),
             admin=dict(choices=['up', 'down']),
             description=dict(),
             type=dict(choices=['bridged', 'routed']),
@@ -144,9 +524,13 @@ def main():
             speed=dict(type='str'),
             state=dict(choices=['present', 'absent', 'default'],
                        default='present'),
+            end_state=dict(choices=['fetched', 'computed', 'verified',
+                                    'none'],
+                           default='fetched'),
             hostname=dict(required=True),
             username=dict(required=True),
             password=dict(required=True),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(type='int', default=830)
         ),
         supports_check_mode=True
@@ -156,10 +540,17 @@ def main():
         safe_fail(module, msg='There was a problem loading from the pyhpecw7 '
                   + 'module.', error=str(ie))
 
+    if module.params['name'] and module.params['interfaces']:
+        module.fail_json(msg='name and interfaces are mutually exclusive')
+    if not (module.params['name'] or module.params['interfaces']):
+        module.fail_json(msg='one of name or interfaces is required')
+
     filtered_keys = ('state', 'hostname', 'username', 'password',
-                     'port', 'CHECKMODE', 'name')
+                     'port', 'CHECKMODE', 'name', 'interfaces', 'end_state',
+                     'dns_ttl')
 
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
@@ -167,8 +558,18 @@ def main():
     device = HPCOM7(host=hostname, username=username,
                     password=password, port=port)
 
+    if module.params['interfaces']:
+        try:
+            device.open()
+        except ConnectionError as e:
+            safe_fail(module, device, msg=str(e),
+                      descr='Error opening connection to device.')
+
+        bulk_interfaces(module, device)
+
     name = module.params['name']
     state = module.params['state']
+    end_state_mode = module.params['end_state']
     changed = False
 
     if state == 'present':
@@ -211,6 +612,7 @@ def main():
         safe_fail(module, device, msg=str(e),
                   descr='Error getting existing config.')
 
+    computed = existing
     if state == 'present':
         delta = dict(set(proposed.iteritems()).difference(
             existing.iteritems()))
@@ -219,6 +621,8 @@ def main():
             if not interface.iface_exists:
                 try:
                     interface.create_logical()
+                    invalidate_snapshot(hostname, port,
+                                        ['interface_types', 'facts'])
                     interface.update()
                     changed=True
                     existing = interface.get_config()
@@ -233,12 +637,14 @@ def main():
 
             if delta:
                 interface.build(stage=True, **delta)
+            computed = dict(existing, **delta)
     elif state == 'default':
         defaults = interface.get_default_config()
         delta = dict(set(existing.iteritems()).difference(
             defaults.iteritems()))
         if delta:
             interface.default(stage=True)
+        computed = defaults
     elif state == 'absent':
         if interface.iface_exists:
             if interface.is_ethernet:
@@ -251,12 +657,14 @@ def main():
                     except InterfaceError as e:
                         safe_fail(module, device, msg=str(e),
                                   descr='Error getting default configuration.')
+                computed = defaults
             else:
                 try:
                     interface.remove_logical(stage=True)
                 except InterfaceError as e:
                     safe_fail(module, device, msg=str(e),
                               descr='Error removing logical interface.')
+                computed = {}
 
     commands = None
     end_state = existing
@@ -269,12 +677,26 @@ def main():
         else:
             try:
                 device.execute_staged()
-                end_state = interface.get_config()
+                invalidate_snapshot(hostname, port,
+                                    ['interface_types', 'facts'])
+                if end_state_mode in ['fetched', 'verified']:
+                    end_state = interface.get_config()
             except PYHPError as e:
                 safe_fail(module, device, msg=str(e),
                           descr='Error on device execution.')
             changed = True
 
+            if end_state_mode == 'computed':
+                end_state = computed
+            elif end_state_mode == 'verified':
+                if end_state_mismatch(computed, end_state):
+                    safe_fail(module, device,
+                              msg='end state does not match the computed'
+                              + ' end state', computed=computed,
+                              end_state=end_state)
+            elif end_state_mode == 'none':
+                end_state = None
+
     results = {}
     results['proposed'] = proposed
     results['existing'] = existing
@@ -52,6 +52,19 @@ options:
         default: present
         choices: ['present', 'absent']
         aliases: []
+    end_state:
+        description:
+            - How end_state is reported after changes are committed.
+              fetched reads the config back from the switch.  computed
+              applies the committed changes to the existing config
+              without another read, so values the switch fills in on
+              its own are not included.  verified does both and fails
+              if the fetched config does not match the computed one.
+              none skips end_state.
+        required: false
+        default: fetched
+        choices: ['fetched', 'computed', 'verified', 'none']
+        aliases: []
     hostname:
         description:
             - IP Address or hostname of the Comware v7 device that has
@@ -74,6 +87,17 @@ options:
         default: null
         choices: []
         aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -93,8 +117,8 @@ EXAMPLES = """
 
 """
 
-import socket
 
+from ansible.module_utils.comware_cache import resolve_hostname
 try:
     HAS_PYHP = True
     from pyhpecw7.comware import HPCOM7
@@ -151,9 +175,13 @@ def main():
                          default='v4'),
             state=dict(choices=['present', 'absent'],
                        default='present'),
+            end_state=dict(choices=['fetched', 'computed', 'verified',
+                                    'none'],
+                           default='fetched'),
             hostname=dict(required=True),
             username=dict(required=True),
             password=dict(required=True),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(type='int', default=830)
         ),
         supports_check_mode=True
@@ -164,9 +192,11 @@ def main():
             msg='There was a problem loading from the pyhpecw7 module')
 
     filtered_keys = ('state', 'hostname', 'username', 'password',
-                     'port', 'CHECKMODE', 'name', 'version')
+                     'port', 'CHECKMODE', 'name', 'version', 'end_state',
+                     'dns_ttl')
 
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
@@ -176,6 +206,7 @@ def main():
 
     name = module.params['name']
     state = module.params['state']
+    end_state_mode = module.params['end_state']
     version = module.params['version']
     addr = module.params['addr']
     mask = module.params['mask']
@@ -226,9 +257,11 @@ def main():
     else:
         ips_are_same = False
 
+    computed = {}
     if state == 'present':
         if not ips_are_same:
             ip_int.build(stage=True, **proposed)
+        computed = proposed
     elif state == 'absent':
         if ips_are_same:
             ip_int.remove(stage=True, **existing)
@@ -244,7 +277,8 @@ def main():
         else:
             try:
                 device.execute_staged()
-                end_state = get_existing(ip_int, addr, mask)
+                if end_state_mode in ['fetched', 'verified']:
+                    end_state = get_existing(ip_int, addr, mask)
             except PYHPError as e:
                 safe_fail(module,
                           device,
@@ -252,6 +286,22 @@ def main():
                           msg=str(e))
             changed = True
 
+            if end_state_mode == 'computed':
+                end_state = computed
+            elif end_state_mode == 'verified':
+                if computed and end_state:
+                    verified = compare_ips(ip_stringify(**computed),
+                                           ip_stringify(**end_state))
+                else:
+                    verified = not (computed or end_state)
+                if not verified:
+                    safe_fail(module, device,
+                              msg='end state does not match the computed'
+                              + ' end state', computed=computed,
+                              end_state=end_state)
+            elif end_state_mode == 'none':
+                end_state = None
+
     results = {}
     results['proposed'] = proposed
     results['existing'] = existing
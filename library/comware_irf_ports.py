@@ -95,6 +95,17 @@ options:
         default: null
         choices: []
         aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -119,8 +130,8 @@ EXAMPLES = """
       removal_override: yes
 
 """
-import socket
 
+from ansible.module_utils.comware_cache import resolve_hostname
 try:
     HAS_PYHP = True
     from pyhpecw7.comware import HPCOM7
@@ -169,6 +180,7 @@ def main():
             hostname=dict(required=True),
             username=dict(required=True),
             password=dict(required=True),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(type='int', default=830)
         ),
         supports_check_mode=True
@@ -179,9 +191,10 @@ def main():
             msg='There was a problem loading from the pyhpecw7comware module')
 
     filtered_keys = ('hostname', 'username', 'password',
-                     'port', 'CHECKMODE', 'member_id')
+                     'port', 'CHECKMODE', 'member_id', 'dns_ttl')
 
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
@@ -39,6 +39,17 @@ options:
         default: null
         choices: []
         aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -54,7 +65,8 @@ EXAMPLES = """
 
 """
 
-import socket
+from ansible.module_utils.comware_cache import (
+    resolve_hostname, invalidate_snapshot)
 try:
     HAS_PYHP = True
     from pyhpecw7.features.l2vpn import L2VPN
@@ -82,6 +94,7 @@ def main():
     module = AnsibleModule(
         argument_spec=dict(
             state=dict(choices=['enabled', 'disabled'], required=True),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(default=830, type='int'),
             hostname=dict(required=True),
             username=dict(required=True),
@@ -97,7 +110,8 @@ def main():
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
 
     device_args = dict(host=hostname, username=username,
                        password=password, port=port)
@@ -137,6 +151,7 @@ def main():
         else:
             try:
                 device.execute_staged()
+                invalidate_snapshot(hostname, port, ['l2vpn'])
                 end_state = l2vpn.get_config()
             except PYHPError as e:
                 safe_fail(module, device, msg=str(e),
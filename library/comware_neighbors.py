@@ -9,13 +9,74 @@ description:
     - Retrieve active LLDP neighbors (read-only)
 version_added: 1.8
 category: Read-Only
+notes:
+    - With hosts, the neighbors of every switch in the list are
+      collected concurrently from one task and combined into a graph
+      with nodes keyed by the hostname neighbors advertise and links
+      as [node, port, neighbor node, neighbor port].  A link reported
+      by the switches at both of its ends is listed once.
 options:
     neigh_type:
         description:
-            - type of neighbors
+            - type of neighbors.  all returns the LLDP and CDP
+              neighbors together, keyed by local interface, with a
+              list of lldp and a list of cdp neighbors on each.
         required: false
         default: lldp
-        choices: ['lldp', 'cdp']
+        choices: ['lldp', 'cdp', 'all']
+        aliases: []
+    hosts:
+        description:
+            - List of IP addresses or hostnames of Comware v7 devices
+              to collect neighbors from instead of hostname, and build
+              a topology graph.  Typically used with run_once.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+    workers:
+        description:
+            - Maximum number of switches in hosts collected from at
+              the same time
+        required: false
+        default: 50
+        choices: []
+        aliases: []
+    host_timeout:
+        description:
+            - NETCONF timeout in seconds for each switch in hosts
+        required: false
+        default: 30
+        choices: []
+        aliases: []
+    graph_file:
+        description:
+            - Local file the graph built with hosts is written to as
+              compact JSON instead of being returned by the module
+        required: false
+        default: null
+        choices: []
+        aliases: []
+    ignore_failed:
+        description:
+            - Build the graph from the switches in hosts that could be
+              reached instead of failing when some could not.  They
+              are still returned in failed_hosts with the error each
+              one failed with.
+        required: false
+        default: false
+        choices: ['true', 'false', 'yes', 'no']
+        aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
         aliases: []
     port:
         description:
@@ -27,8 +88,8 @@ options:
     hostname:
         description:
             - IP Address or hostname of the Comware v7 device that has
-              NETCONF enabled
-        required: true
+              NETCONF enabled.  Required unless hosts is used.
+        required: false
         default: null
         choices: []
         aliases: []
@@ -54,13 +115,29 @@ EXAMPLES = '''
 # get lldp neighbors
 - comware_neighbors: username={{ username }} password={{ password }} hostname={{ inventory_hostname }}
 
+# get lldp and cdp neighbors, keyed by local interface
+- comware_neighbors: neigh_type=all username={{ username }} password={{ password }} hostname={{ inventory_hostname }}
+
+# build the lldp topology of every switch in the play
+- comware_neighbors:
+    hosts: "{{ play_hosts }}"
+    workers: 100
+    graph_file: /tmp/topology.json
+    ignore_failed: true
+    username: "{{ username }}"
+    password: "{{ password }}"
+  run_once: true
+
 '''
 
 import socket
+import json
+from multiprocessing.pool import ThreadPool
+from ansible.module_utils.comware_cache import resolve_hostname
 try:
     HAS_PYHP = True
-    from pyhpecw7.features.neighbor import Neighbors
     from pyhpecw7.comware import HPCOM7
+    from pyhpecw7.utils.xml.lib import *
     from pyhpecw7.features.errors import *
     from pyhpecw7.errors import *
 except ImportError as ie:
@@ -79,12 +156,243 @@ def safe_exit(module, device=None, **kwargs):
     module.exit_json(**kwargs)
 
 
+NEIGHBOR_KEY_MAPS = {
+    'lldp': {
+        'neighbor': 'SystemName',
+        'neighbor_intf': 'PortId',
+        'chassis_id': 'ChassisId',
+    },
+    'cdp': {
+        'neighbor': 'ManageAdress',
+        'neighbor_intf': 'PortId',
+    },
+}
+
+
+def get_neighbors(device, neigh_type):
+    """Get the neighbors of the switch along with its interface
+    names and hostname with one NETCONF get, instead of one get per
+    neighbor to look up the name of its local interface.  With
+    neigh_type all, the LLDP and CDP tables share the get.
+
+    Returns:
+        The hostname of the switch and a dict with a list per
+        neighbor type of the local_intf, neighbor, neighbor_intf
+        and, for lldp, chassis_id of each neighbor.
+    """
+    if neigh_type == 'all':
+        ntypes = ['lldp', 'cdp']
+    else:
+        ntypes = [neigh_type]
+
+    E = data_element_maker()
+    neighbor_filters = []
+    if 'lldp' in ntypes:
+        neighbor_filters.append(E.LLDPNeighbors(E.LLDPNeighbor()))
+    if 'cdp' in ntypes:
+        neighbor_filters.append(E.CDPNeighbors(E.CDPNeighbor()))
+    top = E.top(
+        E.LLDP(
+            *neighbor_filters
+        ),
+        E.Ifmgr(
+            E.Interfaces(
+                E.Interface(
+                    E.IfIndex(),
+                    E.Name()
+                )
+            )
+        ),
+        E.Device(
+            E.Base(
+                E.HostName()
+            )
+        )
+    )
+
+    nc_get_reply = device.get(('subtree', top))
+    data = nc_get_reply.data_ele
+
+    names = {}
+    ifmgr = find_in_data('Ifmgr', data)
+    if ifmgr is not None:
+        for intf in findall_in_data('Interface', ifmgr):
+            index = find_in_data('IfIndex', intf)
+            name = find_in_data('Name', intf)
+            if index is not None and name is not None:
+                names[index.text] = name.text
+
+    hostname = find_in_data('HostName', data)
+    if hostname is not None:
+        hostname = hostname.text
+
+    tables = {}
+    for ntype in ntypes:
+        key_map = NEIGHBOR_KEY_MAPS[ntype]
+        tag = 'CDPNeighbor' if ntype == 'cdp' else 'LLDPNeighbor'
+        neighbors = []
+        for neigh in findall_in_data(tag, data):
+            # a row without the local port cannot be placed
+            index = find_in_data('IfIndex', neigh)
+            if index is None:
+                continue
+            temp = {}
+            temp['local_intf'] = names.get(index.text, index.text)
+            for new_key, xml_tag in key_map.items():
+                obj = find_in_data(xml_tag, neigh)
+                if obj is not None:
+                    temp[new_key] = obj.text
+            neighbors.append(temp)
+        tables[ntype] = neighbors
+
+    return hostname, tables
+
+
+def merge_neighbors(tables):
+    """Merge the neighbor tables into one dict keyed by local
+    interface, with the neighbors of each type on that interface.
+    """
+    merged = {}
+    for ntype, neighbors in tables.items():
+        for neigh in neighbors:
+            neigh = dict(neigh)
+            intf = merged.setdefault(neigh.pop('local_intf'),
+                                     dict(lldp=[], cdp=[]))
+            intf[ntype].append(neigh)
+
+    return merged
+
+
+def graph_neighbors(tables):
+    """Return the neighbors to build the graph from.  CDP only
+    identifies neighbors by address, so a CDP neighbor is used only
+    on interfaces without an LLDP neighbor.
+    """
+    neighbors = list(tables.get('lldp', []))
+    lldp_intfs = set(neigh['local_intf'] for neigh in neighbors)
+    for neigh in tables.get('cdp', []):
+        if neigh['local_intf'] not in lldp_intfs:
+            neighbors.append(neigh)
+
+    return neighbors
+
+
+def collect_neighbors(host, params):
+    """Get the neighbors of one switch in its own NETCONF session.
+    """
+    result = dict(host=host)
+    device = None
+    # a switch that cannot be reached is left out of the graph
+    # rather than stopping the collection from the others
+    try:
+        address = resolve_hostname(host, params['dns_ttl'])
+        device = HPCOM7(host=address, username=params['username'],
+                        password=params['password'], port=params['port'],
+                        timeout=params['host_timeout'])
+        device.open()
+        result['hostname'], tables = get_neighbors(device,
+                                                   params['neigh_type'])
+        result['neighbors'] = graph_neighbors(tables)
+    except (PYHPError, socket.error) as e:
+        result['failed'] = str(e) or e.__class__.__name__
+    finally:
+        if device:
+            try:
+                device.close()
+            except (PYHPError, socket.error):
+                pass
+
+    return result
+
+
+def build_graph(results):
+    """Build the adjacency graph of the switches from their
+    neighbor tables.  Each end of a link is a (node, port) pair,
+    where node is the hostname the neighbors advertise, and a link
+    seen from both of its ends is kept once.
+
+    Returns:
+        A dict with the nodes keyed by name and the links as
+        [node, port, neighbor node, neighbor port] lists.
+    """
+    nodes = {}
+    links = []
+    adjacency = {}
+    for result in results:
+        name = result['hostname'] or result['host']
+        nodes.setdefault(name, {})['host'] = result['host']
+        for neigh in result['neighbors']:
+            peer = neigh.get('neighbor')
+            if not peer:
+                continue
+            node = nodes.setdefault(peer, {})
+            if neigh.get('chassis_id'):
+                node['chassis_id'] = neigh['chassis_id']
+            local = (name, neigh['local_intf'])
+            remote = (peer, neigh.get('neighbor_intf'))
+            if adjacency.get(remote) == local:
+                continue
+            adjacency[local] = remote
+            links.append(list(local + remote))
+
+    return dict(nodes=nodes, links=sorted(links))
+
+
+def collect_topology(module):
+    """Collect the neighbors of every switch in hosts on a pool
+    of workers, build the graph, and exit.
+    """
+    hosts = module.params['hosts']
+    graph_file = module.params['graph_file']
+
+    def collect(host):
+        return collect_neighbors(host, module.params)
+
+    collected = []
+    failed = {}
+    pool = ThreadPool(max(1, min(module.params['workers'], len(hosts))))
+    try:
+        for result in pool.imap_unordered(collect, hosts):
+            if result.get('failed'):
+                failed[result['host']] = result['failed']
+            else:
+                collected.append(result)
+    finally:
+        pool.close()
+
+    graph = build_graph(collected)
+
+    results = {}
+    results['hosts'] = len(hosts)
+    results['failed_hosts'] = failed
+    results['nodes'] = len(graph['nodes'])
+    results['links'] = len(graph['links'])
+    if graph_file:
+        with open(graph_file, 'w') as graph_out:
+            json.dump(graph, graph_out, separators=(',', ':'),
+                      sort_keys=True)
+        results['graph_file'] = graph_file
+    else:
+        results['graph'] = graph
+
+    if failed and not module.params['ignore_failed']:
+        safe_fail(module, msg='could not collect neighbors from {0} of {1}'
+                  ' hosts'.format(len(failed), len(hosts)), **results)
+    safe_exit(module, **results)
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            neigh_type=dict(default='lldp', choices=['cdp', 'lldp']),
+            neigh_type=dict(default='lldp', choices=['cdp', 'lldp', 'all']),
+            hosts=dict(type='list'),
+            workers=dict(default=50, type='int'),
+            host_timeout=dict(default=30, type='int'),
+            graph_file=dict(),
+            ignore_failed=dict(default=False, choices=BOOLEANS, type='bool'),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(default=830, type='int'),
-            hostname=dict(required=True),
+            hostname=dict(required=False),
             username=dict(required=True),
             password=dict(required=True),
         ),
@@ -95,10 +403,19 @@ def main():
         module.fail_json(msg='There was a problem loading from the pyhpecw7 '
                          + 'module.', error=str(ie))
 
+    if module.params['hostname'] and module.params['hosts']:
+        module.fail_json(msg='hostname and hosts are mutually exclusive')
+    if not (module.params['hostname'] or module.params['hosts']):
+        module.fail_json(msg='one of hostname or hosts is required')
+
+    if module.params['hosts']:
+        collect_topology(module)
+
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
 
     device_args = dict(host=hostname, username=username,
                        password=password, port=port)
@@ -114,12 +431,15 @@ def main():
                   descr='error opening conn to device')
 
     try:
-        neighbors = Neighbors(device)
+        tables = get_neighbors(device, neigh_type)[1]
     except PYHPError as e:
         safe_fail(module, device, msg=str(e),
                   descr='error getting neighbor info')
 
-    response = getattr(neighbors, neigh_type)
+    if neigh_type == 'all':
+        response = merge_neighbors(tables)
+    else:
+        response = tables[neigh_type]
 
     results = dict(neighbors=response)
     safe_exit(module, device, **results)
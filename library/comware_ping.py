@@ -10,14 +10,56 @@ description:
       for reachability testing.
 version_added: 1.8
 category: Read-Only
+notes:
+    - With hosts, the pings are run with the ping CLI command so that
+      count and timeout can be set, and the packets_tx, packets_rx,
+      loss_rate, min, avg and max of each target are returned in the
+      same form as for host.  Targets with some loss are returned in
+      lossy_targets.  These pings don't lock the running datastore, so
+      the workers sessions don't hold each other up.
 options:
     host:
         description:
-            - IP or name (resolvable by the switch) that you want to ping
-        required: true
+            - IP or name (resolvable by the switch) that you want to ping.
+              Required unless hosts is used.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+    hosts:
+        description:
+            - List of IPs or names (resolvable by the switch) to ping
+              instead of host.  The response is then a list with the
+              statistics of each target, and the targets that did not
+              reply at all are returned in failed_targets.
+        required: false
         default: null
         choices: []
         aliases: []
+    count:
+        description:
+            - Number of echo requests sent to each target in hosts
+        required: false
+        default: 5
+        choices: []
+        aliases: []
+    timeout:
+        description:
+            - Milliseconds to wait for each echo reply from a target
+              in hosts
+        required: false
+        default: 2000
+        choices: []
+        aliases: []
+    workers:
+        description:
+            - Number of NETCONF sessions to the switch the targets in
+              hosts are split over.  Each session pings its targets
+              one after the other.
+        required: false
+        default: 4
+        choices: []
+        aliases: []
     vrf:
         description:
             - VRF instance pings should be sourced from
@@ -25,6 +67,17 @@ options:
         default: null
         choices: []
         aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -60,15 +113,34 @@ EXAMPLES = """
 # test reachability to 8.8.8.8
 - comware_ping: host=8.8.8.8 username={{ username }} password={{ password }} hostname={{ inventory_hostname }}
 
+# test reachability to many targets after a change
+- comware_ping:
+    hosts:
+      - 10.1.1.1
+      - 10.1.1.2
+      - 10.1.2.1
+    count: 3
+    timeout: 500
+    workers: 8
+    username: "{{ username }}"
+    password: "{{ password }}"
+    hostname: "{{ inventory_hostname }}"
+
 """
 
-import socket
+import re
+from multiprocessing.pool import ThreadPool
+from ansible.module_utils.comware_cache import resolve_hostname
 try:
     HAS_PYHP = True
     from pyhpecw7.features.ping import Ping
+    from pyhpecw7.utils.validate import valid_ip_network
     from pyhpecw7.comware import HPCOM7
     from pyhpecw7.features.errors import *
     from pyhpecw7.errors import *
+    from ncclient.operations.rpc import RPCError
+    import ncclient.transport.errors as NcTransErrors
+    import ncclient.operations.errors as NcOpErrors
 except ImportError as ie:
     HAS_PYHP = False
 
@@ -85,12 +157,150 @@ def safe_exit(module, device=None, **kwargs):
     module.exit_json(**kwargs)
 
 
+PING_TX_RE = re.compile(r'(\d+) packet\(s\) transmitted, (\d+) packet\(s\)'
+                        r' received, ([\d.]+)% packet loss')
+PING_RTT_RE = re.compile(r'min/avg/max/std-dev = ([\d.]+)/([\d.]+)/'
+                         r'([\d.]+)/([\d.]+) ms')
+
+
+def ping_command(target, count, timeout, vrf=None, v6=False):
+    command = ['ping']
+    if v6 or ':' in target:
+        command.append('ipv6')
+    command.extend(['-c', str(count), '-t', str(timeout)])
+    if vrf:
+        command.extend(['-vpn-instance', vrf])
+    command.append(target)
+    return ' '.join(command)
+
+
+def parse_ping(target, output):
+    """Return the loss and round trip statistics of the CLI output
+    of a ping, with the same keys as the response of a single ping.
+    """
+    stats = dict(host=target)
+    match = PING_TX_RE.search(output)
+    if match:
+        stats['packets_tx'], stats['packets_rx'], loss = match.groups()
+        stats['loss_rate'] = loss.split('.')[0]
+    match = PING_RTT_RE.search(output)
+    if match:
+        stats['min'], stats['avg'], stats['max'] = match.groups()[:3]
+    return stats
+
+
+def cli_display_unlocked(device, command):
+    """Run a display command like HPCOM7.cli_display(), without the
+    lock on the running datastore that HPCOM7 takes around every RPC.
+    A ping holds the RPC open for up to count * timeout, and under that
+    lock the other sessions pinging from the same switch would get
+    lock-denied.
+    """
+    if device.connected is not True:
+        raise ConnectionClosedError(device)
+
+    try:
+        rsp = device.connection.cli_display(command)
+    except RPCError as e:
+        raise NCError(e)
+    except NcOpErrors.TimeoutExpiredError:
+        raise NCTimeoutError
+    except NcTransErrors.TransportError:
+        raise ConnectionClosedError(device)
+
+    text = device._find_between(rsp.xml, 'CDATA[', ']]')
+    return device._strip_return(text)
+
+
+def ping_targets(targets, params):
+    """Ping each target in turn from one NETCONF session to the
+    switch and return the statistics of each.
+    """
+    count = params['count']
+    timeout = params['timeout']
+    # a ping takes up to count * timeout on the switch
+    rpc_timeout = 30 + count * timeout // 1000
+
+    rows = []
+    device = HPCOM7(host=params['address'], username=params['username'],
+                    password=params['password'], port=params['port'],
+                    timeout=rpc_timeout)
+    try:
+        device.open()
+        for target in targets:
+            command = ping_command(target, count, timeout,
+                                   params['vrf'], params['v6'])
+            try:
+                rows.append(parse_ping(
+                    target, cli_display_unlocked(device, command)))
+            except PYHPError as e:
+                rows.append(dict(host=target, error=str(e)))
+    except PYHPError as e:
+        rows.extend(dict(host=target, error=str(e))
+                    for target in targets[len(rows):])
+    finally:
+        try:
+            device.close()
+        except Exception:
+            pass
+
+    return rows
+
+
+def ping_sweep(module, address):
+    """Split the targets in hosts over workers sessions to the
+    switch, ping them, and exit with a table of the statistics of
+    each target and the list of targets that did not reply.
+    """
+    targets = module.params['hosts']
+    for target in targets:
+        if ('.' in target or ':' in target) \
+                and not valid_ip_network(target):
+            safe_fail(module, msg=str(InvalidIPAddress(target)))
+
+    params = dict(module.params, address=address)
+    workers = max(1, min(module.params['workers'], len(targets)))
+    chunks = [targets[i::workers] for i in range(workers)]
+
+    def run(chunk):
+        return ping_targets(chunk, params)
+
+    pool = ThreadPool(workers)
+    try:
+        stats = {}
+        for rows in pool.imap_unordered(run, chunks):
+            for row in rows:
+                stats[row['host']] = row
+    finally:
+        pool.close()
+
+    table = [stats[target] for target in targets]
+    failed = [row['host'] for row in table
+              if row.get('error') or row.get('packets_rx', '0') == '0']
+    lossy = [row['host'] for row in table
+             if row['host'] not in failed and row.get('loss_rate') != '0']
+
+    results = {}
+    results['response'] = table
+    results['failed_targets'] = failed
+    results['lossy_targets'] = lossy
+    results['summary'] = dict(targets=len(table), failed=len(failed),
+                              lossy=len(lossy),
+                              ok=len(table) - len(failed) - len(lossy))
+    safe_exit(module, **results)
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            host=dict(required=True, type='str'),
+            host=dict(required=False, type='str'),
+            hosts=dict(type='list'),
+            count=dict(default=5, type='int'),
+            timeout=dict(default=2000, type='int'),
+            workers=dict(default=4, type='int'),
             vrf=dict(required=False, type='str'),
             v6=dict(default=False, choices=BOOLEANS, type='bool'),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(default=830, type='int'),
             hostname=dict(required=True),
             username=dict(required=True),
@@ -103,14 +313,23 @@ def main():
         safe_fail(module, msg='There was a problem loading from the pyhpecw7 '
                   + 'module.', error=str(ie))
 
+    if module.params['host'] and module.params['hosts']:
+        safe_fail(module, msg='host and hosts are mutually exclusive')
+    if not (module.params['host'] or module.params['hosts']):
+        safe_fail(module, msg='one of host or hosts is required')
+
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
 
     device_args = dict(host=hostname, username=username,
                        password=password, port=port)
 
+    if module.params['hosts']:
+        ping_sweep(module, hostname)
+
     device = HPCOM7(**device_args)
 
     host = module.params['host']
@@ -18,11 +18,35 @@ notes:
     - When removing a LAGG, members is not required
     - If mode is set to static, lacp_edge and lacp_mode are disregarded
       if those params are set
+    - The LACP mode of all members that need it, including those
+      being added, is set in the same edit that adds the members, with
+      one row per member.
+    - When groups is used, all aggregation groups, their members and
+      the interfaces are read with one NETCONF get.  A member may move
+      between two groups of the same run; it is removed from its old
+      group before it is added to the new one, and the moves are
+      returned in moves.  The changes of all groups are pushed
+      together and results are keyed by aggregate interface name,
+      e.g. Bridge-Aggregation10.
 options:
     group:
         description:
-            - Group number to identify the Aggregate interface
-        required: true
+            - Group number to identify the Aggregate interface.  Mutually
+              exclusive with groups.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+    groups:
+        description:
+            - List of aggregation groups to configure in a single run.
+              Each entry is either a dictionary with the key group and
+              any of members, type, mode, lacp_mode, lacp_edge,
+              min_ports, max_ports and state, or just a group number.
+              Those options other than members, if set, are used for
+              every entry that does not define its own.  Mutually
+              exclusive with group.
+        required: false
         default: null
         choices: []
         aliases: []
@@ -45,8 +69,9 @@ options:
         aliases: []
     type:
         description:
-            - Type of the Aggregate interface (L2 or L3)
-        required: true
+            - Type of the Aggregate interface (L2 or L3).  Required with
+              group, and for every entry of groups.
+        required: false
         default: null
         choices: ['bridged', 'routed']
         aliases: []
@@ -87,6 +112,17 @@ options:
         default: present
         choices: ['present', 'absent']
         aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -138,15 +174,35 @@ EXAMPLES = """
       hostname: "{{ inventory_hostname }}"
       state: present
 
+  # Reconcile every bridge aggregation of a leaf in one run
+  - comware_portchannel:
+      groups:
+        - group: 10
+          members: [FortyGigE1/0/1, FortyGigE1/0/2]
+        - group: 20
+          members: [FortyGigE1/0/3, FortyGigE1/0/4]
+          lacp_edge: enabled
+        - group: 30
+          state: absent
+      type: bridged
+      mode: dynamic
+      username: "{{ username }}"
+      password: "{{ password }}"
+      hostname: "{{ inventory_hostname }}"
+
 """
 
-import socket
+from collections import OrderedDict
+from ansible.module_utils.comware_cache import (
+    resolve_hostname, invalidate_snapshot)
 try:
     HAS_PYHP = True
     from pyhpecw7.features.portchannel import Portchannel
+    from pyhpecw7.features.interface import Interface
     from pyhpecw7.comware import HPCOM7
     from pyhpecw7.features.errors import *
     from pyhpecw7.errors import *
+    from pyhpecw7.utils.xml.lib import *
 except ImportError as ie:
     HAS_PYHP = False
 
@@ -182,26 +238,444 @@ def get_delta(existing, proposed, existing_members, proposed_members,
     if members_to_add:
         attr_delta['members'] = members_to_add
 
+    # the LACP mode is set on the members of a dynamic group that keep
+    # it and those that join it, and goes out in their member rows
     lacp_to_change = []
-
-    for each in lacp_modes_by_interface:
-        if each.get('lacp_mode') != lacp_mode\
-                and each.get('mode') == 'dynamic':
-            lacp_to_change.append(each.get('interface'))
+    mode = proposed.get('mode') or existing.get('mode')
+    if lacp_mode and mode == 'dynamic':
+        for each in lacp_modes_by_interface:
+            if each.get('lacp_mode') != lacp_mode and each.get(
+                    'interface') not in portchannel.members_to_remove:
+                lacp_to_change.append(each.get('interface'))
+        lacp_to_change.extend(members_to_add)
 
     if lacp_to_change:
         attr_delta['lacp_to_change'] = lacp_to_change
-        portchannel.desired_lacp_mode = attr_delta.pop('lacp_mode')
+        portchannel.desired_lacp_mode = lacp_mode
     if 'lacp_mode' in attr_delta.keys():
         attr_delta.pop('lacp_mode')
 
     return attr_delta
 
 
+def map_member_indexes(portchannel):
+    """Let the portchannel look up the IfIndex of its current
+    members by name from what get_config() read, instead of with a get
+    per member when their rows are built.  get_config() only keys them
+    by lower case name.
+    """
+    for index, name in portchannel._members_map_index_key.items():
+        portchannel._members_map_interface_key[name] = str(index)
+
+
+PC_TYPES = {'bridged': 'Bridge-Aggregation', 'routed': 'Route-Aggregation'}
+
+
+def get_lagg_tables(device):
+    """Get the aggregation groups, the group and LACP mode of every
+    port, and the name and layer of every interface with one
+    NETCONF get.
+
+    Returns:
+        A dictionary of LAGGGroup XML rows keyed by internal group ID,
+        a dictionary of LAGGMember XML rows keyed by IfIndex and a
+        dictionary of Interface XML rows keyed by name.
+    """
+    E = data_element_maker()
+    top = E.top(
+        E.LAGG(
+            E.LAGGGroups(
+                E.LAGGGroup(
+                    E.GroupId(),
+                    E.IfIndex(),
+                    E.LinkMode(),
+                    E.LacpEdgeEnable()
+                )
+            ),
+            E.LAGGMembers(
+                E.LAGGMember(
+                    E.IfIndex(),
+                    E.GroupId(),
+                    E.LacpMode()
+                )
+            )
+        ),
+        E.Ifmgr(
+            E.Interfaces(
+                E.Interface(
+                    E.IfIndex(),
+                    E.Name(),
+                    E.PortLayer()
+                )
+            )
+        )
+    )
+
+    nc_get_reply = device.get(('subtree', top))
+    data = nc_get_reply.data_ele
+
+    group_table = {}
+    for row in findall_in_data('LAGGGroup', data):
+        group_table[find_in_data('GroupId', row).text] = row
+
+    member_table = {}
+    for row in findall_in_data('LAGGMember', data):
+        member_table[find_in_data('IfIndex', row).text] = row
+
+    iface_table = {}
+    for row in findall_in_data('Interface', data):
+        name = find_in_data('Name', row)
+        if name is not None:
+            iface_table[name.text] = row
+
+    return group_table, member_table, iface_table
+
+
+def get_agg_configs(device, pc_types):
+    """Get the CLI config of every aggregate interface of the given
+    types with one display command per type.
+
+    Returns:
+        A dictionary of config lines keyed by interface name.
+    """
+    configs = {}
+    for pc_type in pc_types:
+        text = device.cli_display(
+            'display current-configuration interface {0}'.format(
+                PC_TYPES[pc_type]))
+        name = None
+        for line in text.split('\n'):
+            if line.startswith('interface '):
+                name = line.split(None, 1)[1].strip()
+                configs[name] = []
+            if name is not None:
+                configs[name].append(line)
+
+    return configs
+
+
+if HAS_PYHP:
+    class TablePortchannel(Portchannel):
+        """Portchannel that reads its config, its members and their
+        names from the tables returned by get_lagg_tables() and
+        get_agg_configs() instead of querying the device.
+        """
+        def __init__(self, device, groupid, pc_type, tables, agg_configs):
+            self.group_table, self.member_table, self.iface_table = tables
+            self.agg_configs = agg_configs
+            self.index_names = dict(
+                (find_in_data('IfIndex', row).text, name)
+                for name, row in self.iface_table.iteritems())
+            super(TablePortchannel, self).__init__(device, groupid, pc_type)
+
+        def get_index_from_interface(self, interface):
+            row = self.iface_table.get(interface)
+            if row is None:
+                return ''
+            return find_in_data('IfIndex', row).text
+
+        def get_interface_from_index(self, index):
+            return self.index_names.get(index, index)
+
+        def _get_pc_config_raw(self):
+            self.fulltype = PC_TYPES[self.pc_type]
+            self.raw_config = self.agg_configs.get(
+                '{0}{1}'.format(self.fulltype, self.groupid), [])
+
+        def get_config(self):
+            row = self.group_table.get(self._xgroupid)
+            if row is None:
+                return {}
+
+            return_pc = data_elem_to_dict(row, self.PORTCHANNEL,
+                                          value_map=self.value_map)
+            return_pc['groupid'] = self.groupid
+            return_pc['nc_groupid'] = self._xgroupid
+
+            members = []
+            members_by_name = []
+            for index in sorted(self.member_table, key=int):
+                member = self.member_table[index]
+                if find_in_data('GroupId', member).text != self._xgroupid:
+                    continue
+                name = self.get_interface_from_index(index)
+                lacp = data_elem_to_dict(member, self.LACP,
+                                         value_map=self.lacp_value_map)
+                members_by_name.append(name)
+                members.append(dict(interface=name,
+                                    lacp_mode=lacp.get('lacp_mode')))
+
+            return_pc['members'] = members_by_name
+            return_pc['lacp_modes_by_interface'] = members
+
+            self._get_pc_config_raw()
+
+            return_pc['min_ports'] = self.get_selected_port_min()
+            return_pc['max_ports'] = self.get_selected_port_max()
+
+            return return_pc
+
+
+def order_staged(device):
+    """Regroup the objects staged for several aggregation groups into
+    one ordered commit: the groups that are removed, then every member
+    leaving a group, then every group and member that is added or
+    changed, then the CLI commands.  A member that moves to another
+    group is so released before it is added.  The rows of a port are
+    merged, so that its group and LACP mode are set by one row and the
+    LACP mode changes of all members go out in one payload.
+    """
+    removed = []
+    groups = []
+    members_out = []
+    members_in = OrderedDict()
+    commands = []
+    for item in device.staged:
+        if item['cfg_type'] == 'cli_config':
+            commands.extend(item['config'])
+            continue
+        top = item['config'][0]
+        if top.get(NETCONFBASE_C + 'operation') == 'delete':
+            removed.append(item)
+            continue
+        for row in list(top.iter()):
+            tag = row.tag.split('}')[-1]
+            if tag == 'LAGGGroup':
+                groups.append(row)
+            elif tag == 'LAGGMember':
+                index = find_in_config('IfIndex', row).text
+                if find_in_config('GroupId', row).text == '0':
+                    members_out.append(row)
+                elif index in members_in:
+                    # a port joining a group and getting its LACP mode
+                    # is set by one row
+                    for child in list(row):
+                        if find_in_config(child.tag.split('}')[-1],
+                                          members_in[index]) is None:
+                            members_in[index].append(child)
+                else:
+                    members_in[index] = row
+
+    EN = nc_element_maker()
+    E = config_element_maker()
+    staged = list(removed)
+    if members_out:
+        staged.append(dict(cfg_type='edit_config', config=EN.config(
+            E.top(E.LAGG(E.LAGGMembers(*members_out)),
+                  **operation_kwarg('merge')))))
+    if groups or members_in:
+        lagg = E.LAGG()
+        if groups:
+            lagg.append(E.LAGGGroups(*groups))
+        if members_in:
+            lagg.append(E.LAGGMembers(*members_in.values()))
+        staged.append(dict(cfg_type='edit_config', config=EN.config(
+            E.top(lagg, **operation_kwarg('merge')))))
+    if commands:
+        staged.append(dict(cfg_type='cli_config', config=commands))
+
+    device.staged[:] = staged
+
+
+def normalize_iface_name(name):
+    """Return the full interface name pyhpecw7's Interface uses
+    for name, without reading anything from the device.
+    """
+    return Interface.__new__(Interface)._iface_type(name)[0]
+
+
+def get_group_args(groups, params):
+    """Build the list of per-group argument dictionaries from the
+    groups param.
+    """
+    attrs = ('type', 'mode', 'lacp_mode', 'lacp_edge', 'min_ports',
+             'max_ports', 'state')
+
+    group_args = []
+    for entry in groups:
+        if not isinstance(entry, dict):
+            entry = dict(group=entry)
+        args = dict((k, entry.get(k, params.get(k))) for k in attrs)
+        args = dict((k, str(v)) for k, v in args.iteritems()
+                    if v is not None)
+        args['group'] = str(entry.get('group'))
+        args['members'] = entry.get('members')
+        group_args.append(args)
+
+    return group_args
+
+
+def reconcile_groups(module, device, hostname):
+    """Configure every aggregation group in the groups param against
+    one read of all groups, members and interfaces, and push the
+    changes of all groups in one ordered commit.  Members may move
+    between groups of the same run.
+    """
+    port = module.params['port']
+    group_args = get_group_args(module.params['groups'], module.params)
+
+    for args in group_args:
+        if not args.get('type'):
+            safe_fail(module, device, group=args['group'],
+                      msg='type is required for every group.')
+        if args['members'] is not None \
+                and not isinstance(args['members'], list):
+            safe_fail(module, device, group=args['group'],
+                      msg='members of every group must be a list.')
+        if args['members']:
+            args['members'] = [normalize_iface_name(str(member))
+                               for member in args['members']]
+        if args['state'] == 'present' and not args['members']:
+            safe_fail(module, device, group=args['group'],
+                      msg='members param required when state=present')
+        if args.get('mode') == 'static' and args.get('lacp_mode'):
+            args.pop('lacp_mode')
+            args.pop('lacp_edge', None)
+
+    try:
+        tables = get_lagg_tables(device)
+    except PYHPError as e:
+        safe_fail(module, device, msg=str(e),
+                  descr='error getting existing config')
+    group_table, member_table, iface_table = tables
+
+    agg_configs = {}
+    portchannels = []
+    names = {}
+    for args in group_args:
+        portchannel = TablePortchannel(device, args['group'], args['type'],
+                                       tables, agg_configs)
+        name = '{0}{1}'.format(PC_TYPES[args['type']], args['group'])
+        if portchannel._xgroupid in names:
+            safe_fail(module, device,
+                      msg='{0} is listed more than once.'.format(name))
+        names[portchannel._xgroupid] = name
+        portchannels.append((name, portchannel, args))
+
+    # internal group ID of every port that is a member of a group, and
+    # the members each group of this run keeps
+    member_groups = {}
+    for index, row in member_table.iteritems():
+        group = find_in_data('GroupId', row).text
+        if group != '0':
+            member_groups[index] = group
+    kept = dict((portchannel._xgroupid, set(args['members'] or [])
+                 if args['state'] == 'present' else set())
+                for name, portchannel, args in portchannels)
+
+    moves = []
+    claimed = {}
+    for name, portchannel, args in portchannels:
+        if args['state'] != 'present':
+            continue
+        for member in args['members']:
+            row = iface_table.get(member)
+            if row is None:
+                safe_fail(module, device, group=name,
+                          msg='{0} doesn\'t exist on the device.'.format(
+                              member))
+            layer = find_in_data('PortLayer', row)
+            port_type = {'1': 'bridged', '2': 'routed'}.get(
+                layer.text if layer is not None else None)
+            if port_type != portchannel.pc_type:
+                safe_fail(module, device, group=name, msg=str(
+                    InvalidPortType(member, port_type, portchannel.pc_type)))
+            if member in claimed:
+                safe_fail(module, device,
+                          msg='{0} is listed in both {1} and {2}.'.format(
+                              member, claimed[member], name))
+            claimed[member] = name
+
+            current = member_groups.get(find_in_data('IfIndex', row).text)
+            if current and current != portchannel._xgroupid:
+                if current in kept and member not in kept[current]:
+                    moves.append({'interface': member,
+                                  'from': names[current], 'to': name})
+                else:
+                    safe_fail(module, device, group=name,
+                              msg=str(AggregationGroupError(member)))
+
+    try:
+        agg_configs.update(get_agg_configs(device, set(
+            portchannel.pc_type for name, portchannel, args in portchannels
+            if portchannel._xgroupid in group_table)))
+    except PYHPError as e:
+        safe_fail(module, device, msg=str(e),
+                  descr='error getting existing config')
+
+    proposed = {}
+    existing = {}
+    for name, portchannel, args in portchannels:
+        existing[name] = portchannel.get_config()
+        existing_members = existing[name].pop('members', [])
+
+        proposed[name] = dict((k, v) for k, v in args.iteritems()
+                              if k in ('groupid', 'lacp_edge', 'mode',
+                                       'min_ports', 'max_ports',
+                                       'lacp_mode'))
+        proposed[name]['groupid'] = args['group']
+
+        if args['state'] == 'present':
+            delta = get_delta(existing[name], dict(proposed[name]),
+                              existing_members, args['members'],
+                              args.get('lacp_mode'), portchannel)
+            if delta or portchannel.members_to_remove:
+                portchannel.build(stage=True, **delta)
+        elif existing[name]:
+            portchannel.remove(stage=True)
+
+        proposed[name]['members'] = args['members']
+        proposed[name]['type'] = args['type']
+        proposed[name]['state'] = args['state']
+
+    order_staged(device)
+
+    commands = None
+    end_state = existing
+    changed = False
+
+    if device.staged:
+        commands = device.staged_to_string()
+        if module.check_mode:
+            safe_exit(module, device, changed=True,
+                      commands=commands, moves=moves)
+        else:
+            try:
+                device.execute_staged()
+                invalidate_snapshot(hostname, port,
+                                    ['portchannel_members', 'interface_types',
+                                     'facts'])
+                for table, new_table in zip(tables, get_lagg_tables(device)):
+                    table.clear()
+                    table.update(new_table)
+                agg_configs.clear()
+                agg_configs.update(get_agg_configs(device, set(
+                    portchannel.pc_type
+                    for name, portchannel, args in portchannels
+                    if portchannel._xgroupid in group_table)))
+                end_state = dict((name, portchannel.get_config())
+                                 for name, portchannel, args in portchannels)
+            except PYHPError as e:
+                safe_fail(module, device, msg=str(e),
+                          descr='error during execution')
+            changed = True
+
+    results = {}
+    results['proposed'] = proposed
+    results['existing'] = existing
+    results['moves'] = moves
+    results['commands'] = commands
+    results['changed'] = changed
+    results['end_state'] = end_state
+
+    safe_exit(module, device, **results)
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            group=dict(required=True, type='str'),
+            group=dict(required=False, type='str'),
+            groups=dict(required=False, type='list'),
             members=dict(required=False),
             mode=dict(required=False, choices=['static', 'dynamic']),
             type=dict(required=False, choices=['bridged', 'routed']),
@@ -210,6 +684,7 @@ def main():
             min_ports=dict(required=False, type='str'),
             max_ports=dict(required=False, type='str'),
             state=dict(choices=['present', 'absent'], default='present'),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(default=830, type='int'),
             hostname=dict(required=True),
             username=dict(required=True),
@@ -221,16 +696,33 @@ def main():
         module.fail_json(msg='There was a problem loading from the pyhpecw7 '
                          + 'module.', error=str(ie))
 
+    if module.params['group'] and module.params['groups']:
+        module.fail_json(msg='group and groups are mutually exclusive')
+    if not (module.params['group'] or module.params['groups']):
+        module.fail_json(msg='one of group or groups is required')
+    if module.params['group'] and not module.params['type']:
+        module.fail_json(msg='type is required with group')
+
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
 
     device_args = dict(host=hostname, username=username,
                        password=password, port=port)
 
     device = HPCOM7(**device_args)
 
+    if module.params['groups']:
+        try:
+            device.open()
+        except ConnectionError as e:
+            safe_fail(module, device, msg=str(e),
+                      descr='error connecting to device')
+
+        reconcile_groups(module, device, hostname)
+
     groupid = module.params['group']
     members = module.params['members']
     lacp_mode = module.params['lacp_mode']
@@ -286,9 +778,11 @@ def main():
     if state == 'present':
         delta = get_delta(existing, proposed, existing_members,
                           members, lacp_mode, portchannel)
-        if delta:
+        if delta or portchannel.members_to_remove:
             # delta['groupid'] = groupid
+            map_member_indexes(portchannel)
             portchannel.build(stage=True, **delta)
+            order_staged(device)
     elif state == 'absent':
         if existing:
             portchannel.remove(stage=True)
@@ -304,6 +798,9 @@ def main():
         else:
             try:
                 device.execute_staged()
+                invalidate_snapshot(hostname, port,
+                                    ['portchannel_members', 'interface_types',
+                                     'facts'])
                 end_state = portchannel.get_config()
             except PYHPError as e:
                 safe_fail(module, device, msg=str(e),
@@ -20,18 +20,41 @@ notes:
       them first.
     - If state=default, the switchport settings will be defaulted.
       That means it will be set as an access port in VLAN 1.
+    - When ports is used, the VLAN list, port-channel members, interface
+      table and layer 2 config are each read once for all ports, every
+      port is checked against them, and all changes are pushed together.
+      Results are keyed by interface name.
+    - permitted_vlans_add and permitted_vlans_remove are applied with
+      port trunk permit vlan and undo port trunk permit vlan commands
+      holding only the VLANs that change.  With ports, the commands of
+      all trunks are sent in one request.
 options:
     name:
         description:
-            - Full name of the interface
-        required: true
+            - Full name of the interface.  Mutually exclusive with ports.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+    ports:
+        description:
+            - List of interfaces to configure in a single run.  Each entry
+              is either a dictionary with the key name and any of
+              link_type, pvid, permitted_vlans, permitted_vlans_add and
+              permitted_vlans_remove, or just an interface name.  Those
+              options, if set, are used for every entry that does not
+              define its own.  An entry that sets any of the VLAN lists
+              uses none of the VLAN lists set for all entries.
+              Mutually exclusive with name.
+        required: false
         default: null
         choices: []
         aliases: []
     link_type:
         description:
-            - Layer 2 mode of the interface
-        required: true
+            - Layer 2 mode of the interface.  Required with name, and
+              for every entry of ports unless state=default.
+        required: false
         default: null
         choices: ['access', 'trunk']
         aliases: []
@@ -48,9 +71,30 @@ options:
         description:
             - If mode is set to trunk this will be the complete list/range
               (as a string) of VLANs allowed on that trunk interface.
-              E.g. 1-3,5,8-10
+              E.g. 1-3,5,8-10.  Lists naming the same VLANs, such as
+              1,2,3 and 1-3, are treated as equal.
               Any VLAN not in the list
-              will be removed from the interface.
+              will be removed from the interface.  Mutually exclusive
+              with permitted_vlans_add and permitted_vlans_remove.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+    permitted_vlans_add:
+        description:
+            - VLANs (as a string, e.g. 10,20-30) to permit on a trunk
+              in addition to those it already permits.  Only the VLANs
+              not yet permitted are sent to the switch.  Requires
+              link_type=trunk.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+    permitted_vlans_remove:
+        description:
+            - VLANs (as a string) to remove from the list permitted
+              on a trunk, leaving the other VLANs in place.  Requires
+              link_type=trunk.
         required: false
         default: null
         choices: []
@@ -62,6 +106,19 @@ options:
         default: present
         choices: ['present', 'absent']
         aliases: []
+    snapshot_ttl:
+        description:
+            - Seconds for which the state used only for validation (the
+              VLAN list, port-channel members and interface layers) is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  The cache is cleared when
+              comware_vlan, comware_interface, comware_portchannel,
+              comware_install_config or comware_command (type=config)
+              commit changes.  0 disables the cache.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     hostname:
         description:
             - IP Address or hostname of the Comware v7 device that has
@@ -84,6 +141,17 @@ options:
         default: null
         choices: []
         aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -100,17 +168,49 @@ EXAMPLES = """
 # Basic trunk config
 - comware_switchport: name=FortyGigE1/0/2 link_type=trunk permitted_vlans="1-3,5,8-10" username={{ username }} password={{ password }} hostname={{ inventory_hostname }}
 
+# Provision a row of access ports and an uplink trunk in one run
+- comware_switchport:
+    ports:
+      - FortyGigE1/0/3
+      - FortyGigE1/0/4
+      - FortyGigE1/0/5
+      - name: FortyGigE1/0/32
+        link_type: trunk
+        pvid: 1
+        permitted_vlans: 1-10
+    link_type: access
+    pvid: 3
+    username: "{{ username }}"
+    password: "{{ password }}"
+    hostname: "{{ inventory_hostname }}"
+
+# Roll VLAN 300 out to every uplink trunk without touching their other VLANs
+- comware_switchport:
+    ports:
+      - FortyGigE1/0/31
+      - FortyGigE1/0/32
+    link_type: trunk
+    permitted_vlans_add: 300
+    username: "{{ username }}"
+    password: "{{ password }}"
+    hostname: "{{ inventory_hostname }}"
+
 """
 
-import socket
+import re
+import heapq
+import bisect
 
+from ansible.module_utils.comware_cache import resolve_hostname, get_snapshot
 try:
     HAS_PYHP = True
     from pyhpecw7.comware import HPCOM7
     from pyhpecw7.features.switchport import Switchport
+    from pyhpecw7.features.interface import Interface
     from pyhpecw7.features.vlan import Vlan
     from pyhpecw7.features.portchannel import Portchannel
     from pyhpecw7.errors import PYHPError
+    from pyhpecw7.utils.xml.lib import *
 except ImportError as ie:
     HAS_PYHP = False
 
@@ -127,19 +227,596 @@ def safe_exit(module, device=None, **kwargs):
     module.exit_json(**kwargs)
 
 
+class VlanSet(object):
+    """Set of VLAN IDs kept as sorted, non-overlapping (low, high)
+    ranges, so that a trunk permitting most of 1-4094 stays a few
+    ranges long.  Set operations walk the ranges of both sets once.
+    """
+    def __init__(self, ranges=()):
+        self.ranges = []
+        for low, high in sorted(ranges):
+            self._append(low, high)
+
+    def _append(self, low, high):
+        # ranges must be appended in order of low
+        if self.ranges and low <= self.ranges[-1][1] + 1:
+            if high > self.ranges[-1][1]:
+                self.ranges[-1] = (self.ranges[-1][0], high)
+        else:
+            self.ranges.append((low, high))
+
+    @classmethod
+    def parse(cls, vlans):
+        """Parse VLAN IDs given as a Comware range string such as
+        1-3,5 (or the CLI form 1 to 3 5), a single ID, or a list of
+        either.  Raises ValueError for IDs outside 1-4094.
+        """
+        if vlans is None:
+            return cls()
+        if not isinstance(vlans, (list, tuple)):
+            vlans = [vlans]
+
+        ranges = []
+        for item in vlans:
+            text = re.sub(r'\s+to\s+', '-', str(item).strip())
+            for each in re.split(r'[,\s]+', text):
+                if not each:
+                    continue
+                if '-' in each:
+                    low, high = each.split('-', 1)
+                    low, high = int(low), int(high)
+                else:
+                    low = high = int(each)
+                if not 1 <= low <= high <= 4094:
+                    raise ValueError('invalid VLAN range {0}'.format(each))
+                ranges.append((low, high))
+
+        return cls(ranges)
+
+    def __or__(self, other):
+        union = VlanSet()
+        for low, high in heapq.merge(self.ranges, other.ranges):
+            union._append(low, high)
+        return union
+
+    def __sub__(self, other):
+        difference = VlanSet()
+        others = other.ranges
+        j = 0
+        for low, high in self.ranges:
+            while j < len(others) and others[j][1] < low:
+                j += 1
+            k = j
+            while low <= high and k < len(others) \
+                    and others[k][0] <= high:
+                if others[k][0] > low:
+                    difference.ranges.append((low, others[k][0] - 1))
+                low = max(low, others[k][1] + 1)
+                k += 1
+            if low <= high:
+                difference.ranges.append((low, high))
+        return difference
+
+    def __and__(self, other):
+        return self - (self - other)
+
+    def __eq__(self, other):
+        return isinstance(other, VlanSet) and self.ranges == other.ranges
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __len__(self):
+        return sum(high - low + 1 for low, high in self.ranges)
+
+    def __nonzero__(self):
+        return bool(self.ranges)
+
+    __bool__ = __nonzero__
+
+    def __contains__(self, vlanid):
+        vlanid = int(vlanid)
+        i = bisect.bisect_right(self.ranges, (vlanid, 4095)) - 1
+        return i >= 0 and self.ranges[i][0] <= vlanid <= self.ranges[i][1]
+
+    def __iter__(self):
+        for low, high in self.ranges:
+            for vlanid in range(low, high + 1):
+                yield vlanid
+
+    def __str__(self):
+        """Comware range syntax, e.g. 1-3,5
+        """
+        return ','.join(str(low) if low == high
+                        else '{0}-{1}'.format(low, high)
+                        for low, high in self.ranges)
+
+    def cli_ranges(self, per_command=10):
+        """Return the ranges in CLI syntax, e.g. 1 to 3 5, split into
+        strings of at most per_command ranges, the most one port trunk
+        permit vlan command accepts.
+        """
+        items = [str(low) if low == high
+                 else '{0} to {1}'.format(low, high)
+                 for low, high in self.ranges]
+        return [' '.join(items[i:i + per_command])
+                for i in range(0, len(items), per_command)]
+
+
+VLAN_KEYS = ('permitted_vlans', 'permitted_vlans_add',
+             'permitted_vlans_remove')
+
+
+def normalize_vlans(config):
+    """Return a copy of a switchport config with the VLAN lists
+    in the compact range form, so that lists naming the same VLANs
+    compare equal.
+    """
+    config = dict(config)
+    for key in VLAN_KEYS:
+        if config.get(key) is not None:
+            config[key] = str(VlanSet.parse(config[key]))
+    return config
+
+
+def get_vlan_increment(existing, args):
+    """Return the VLANs of permitted_vlans_add that the trunk does
+    not permit yet, and the VLANs of permitted_vlans_remove that it
+    does.  A port that is not a trunk yet permits only VLAN 1 once
+    it is converted.
+    """
+    if existing.get('link_type') == 'trunk':
+        permitted = VlanSet.parse(existing.get('permitted_vlans'))
+    else:
+        permitted = VlanSet.parse(1)
+    add = VlanSet.parse(args.get('permitted_vlans_add'))
+    remove = VlanSet.parse(args.get('permitted_vlans_remove'))
+    if add & remove:
+        raise ValueError('VLANs {0} are both added and'.format(add & remove)
+                         + ' removed.')
+
+    return add - permitted, remove & permitted
+
+
+def get_increment_commands(interface_name, add, remove):
+    """Return the CLI commands that permit the VLANs of add and
+    remove those of remove on a trunk, leaving the rest of its
+    permitted list as it is.
+    """
+    commands = ['interface {0}'.format(interface_name)]
+    commands.extend('port trunk permit vlan {0}'.format(vlans)
+                    for vlans in add.cli_ranges())
+    commands.extend('undo port trunk permit vlan {0}'.format(vlans)
+                    for vlans in remove.cli_ranges())
+    commands.append('quit')
+    return commands
+
+
+def check_vlan_args(args):
+    """Return an error message when the VLAN lists of a port's
+    arguments can't be applied, or None.
+    """
+    increment = [key for key in VLAN_KEYS[1:] if args.get(key)]
+    if increment and args.get('permitted_vlans'):
+        return 'permitted_vlans and {0} are mutually'.format(
+            ' and '.join(increment)) + ' exclusive.'
+    if increment and args.get('link_type') != 'trunk':
+        return '{0} requires link_type=trunk.'.format(' and '.join(increment))
+
+
+def get_iface_types(device):
+    """Return the layer (bridged or routed) of every interface
+    on the switch, keyed by interface name.
+    """
+    E = data_element_maker()
+    top = E.top(
+        E.Ifmgr(
+            E.Interfaces(
+                E.Interface(
+                    E.Name(),
+                    E.PortLayer()
+                )
+            )
+        )
+    )
+
+    nc_get_reply = device.get(('subtree', top))
+
+    key_map = {'name': 'Name', 'type': 'PortLayer'}
+    value_map = {'PortLayer': {'1': 'bridged', '2': 'routed'}}
+    iface_types = {}
+    for row in findall_in_data('Interface', nc_get_reply.data_ele):
+        iface = data_elem_to_dict(row, key_map, value_map=value_map)
+        iface_types[iface.get('name')] = iface.get('type')
+
+    return iface_types
+
+
+def get_iface_table(device):
+    """Get the index, type and layer of every interface on the
+    switch with one NETCONF get.
+
+    Returns:
+        A dictionary of interface XML rows keyed by interface name.
+    """
+    E = data_element_maker()
+    top = E.top(
+        E.Ifmgr(
+            E.Interfaces(
+                E.Interface(
+                    E.IfIndex(),
+                    E.Name(),
+                    E.ifType(),
+                    E.PortLayer()
+                )
+            )
+        )
+    )
+
+    nc_get_reply = device.get(('subtree', top))
+
+    table = {}
+    for row in findall_in_data('Interface', nc_get_reply.data_ele):
+        name = find_in_data('Name', row)
+        if name is not None:
+            table[name.text] = row
+
+    return table
+
+
+def get_switchport_table(device):
+    """Get the layer 2 config of every interface on the switch
+    with one NETCONF get.
+
+    Returns:
+        A dictionary of VLAN interface XML rows keyed by IfIndex.
+    """
+    E = data_element_maker()
+    top = E.top(
+        E.VLAN(
+            E.Interfaces(
+                E.Interface(
+                    E.IfIndex(),
+                    E.LinkType(),
+                    E.PVID(),
+                    E.PermitVlanList()
+                )
+            )
+        )
+    )
+
+    nc_get_reply = device.get(('subtree', top))
+
+    table = {}
+    for row in findall_in_data('Interface', nc_get_reply.data_ele):
+        index = find_in_data('IfIndex', row)
+        if index is not None:
+            table[index.text] = row
+
+    return table
+
+
+if HAS_PYHP:
+    class TableInterface(Interface):
+        """Interface that reads its index and type from a table
+        returned by get_iface_table() instead of querying the device.
+        """
+        def __init__(self, device, interface_name, iface_table):
+            self.iface_table = iface_table
+            super(TableInterface, self).__init__(device, interface_name)
+
+        def _row(self):
+            return self.iface_table.get(self.interface_name)
+
+        def _get_iface_index(self):
+            row = self._row()
+            if row is None:
+                return ''
+            return find_in_data(self._iface_index_name, row).text
+
+        def _is_ethernet_is_routed(self):
+            row = self._row()
+            if row is None:
+                return False, False
+            if_type = find_in_data('ifType', row)
+            port_layer = find_in_data('PortLayer', row)
+            is_ethernet = if_type is not None and if_type.text == '6'
+            is_routed = port_layer is not None and port_layer.text == '2'
+            return is_ethernet, is_routed
+
+    class TableSwitchport(Switchport):
+        """Switchport that reads its interface and layer 2 config from
+        the tables returned by get_iface_table() and
+        get_switchport_table() instead of querying the device.
+        """
+        def __init__(self, device, interface_name, iface_table,
+                     switchport_table):
+            self.device = device
+            self.interface = TableInterface(device, interface_name,
+                                            iface_table)
+            self.interface_name = self.interface.interface_name
+            self.link_type = 'unknown'
+            self.switchport_table = switchport_table
+
+        def get_config(self):
+            row = self.switchport_table.get(self.interface.iface_index)
+            if row is None:
+                return {}
+
+            key_map = {'link_type': 'LinkType',
+                       'permitted_vlans': 'PermitVlanList',
+                       'pvid': 'PVID'}
+            value_map = {'LinkType': {'1': 'access',
+                                      '2': 'trunk'}}
+            config = data_elem_to_dict(row, key_map, value_map=value_map)
+            self.link_type = config.get('link_type', 'unknown')
+
+            return config
+
+
+def get_pc_members(device, iface_table):
+    """Return the names of the interfaces that are members of a
+    port-channel, using the interface table to name them instead of
+    a get per member.
+    """
+    E = data_element_maker()
+    top = E.top(
+        E.LAGG(
+            E.LAGGMembers(
+                E.LAGGMember(
+                    E.IfIndex(),
+                    E.GroupId()
+                )
+            )
+        )
+    )
+
+    nc_get_reply = device.get(('subtree', top))
+
+    names = dict((find_in_data('IfIndex', row).text, name)
+                 for name, row in iface_table.items())
+    members = []
+    for row in findall_in_data('LAGGMember', nc_get_reply.data_ele):
+        index = find_in_data('IfIndex', row).text
+        if find_in_data('GroupId', row).text != '0':
+            members.append(names.get(index, index))
+
+    return members
+
+
+def get_row_parent(config):
+    """Return the element holding the Interface rows of
+    a staged config object.
+    """
+    for ele in config.iter():
+        if ele.tag.split('}')[-1] == 'Interface':
+            return ele.getparent()
+
+
+def get_row_path(row_parent):
+    path = []
+    while row_parent is not None:
+        path.insert(0, (row_parent.tag, dict(row_parent.attrib)))
+        row_parent = row_parent.getparent()
+    return path
+
+
+def merge_staged(device):
+    """Merge consecutive staged objects of the same type that
+    configure rows of the same table into a single object.
+    """
+    merged = []
+    for item in device.staged:
+        if merged and merged[-1]['cfg_type'] == item['cfg_type']:
+            rows = get_row_parent(merged[-1]['config'])
+            new_rows = get_row_parent(item['config'])
+            if rows is not None and new_rows is not None\
+                    and get_row_path(rows) == get_row_path(new_rows):
+                for row in list(new_rows):
+                    rows.append(row)
+                continue
+        merged.append(item)
+
+    device.staged[:] = merged
+
+
+def get_port_args(ports, params):
+    """Build the list of per-port argument dictionaries
+    from the ports param.
+    """
+    attrs = ('link_type', 'pvid') + VLAN_KEYS
+
+    port_args = []
+    for entry in ports:
+        if not isinstance(entry, dict):
+            entry = dict(name=entry)
+        # a VLAN list of the entry replaces all VLAN list defaults,
+        # so that its permitted_vlans isn't mixed with a default
+        # permitted_vlans_add
+        defaults = dict(params)
+        if any(entry.get(k) is not None for k in VLAN_KEYS):
+            for k in VLAN_KEYS:
+                defaults.pop(k, None)
+        args = dict((k, entry.get(k, defaults.get(k))) for k in attrs)
+        args = dict((k, str(v)) for k, v in args.iteritems()
+                    if v is not None)
+        port_args.append((str(entry.get('name')), args))
+
+    return port_args
+
+
+def bulk_switchports(module, device, hostname):
+    """Configure every port in the ports param against indexes of
+    the VLANs, port-channel members and interfaces that are each
+    read once, and push all changes in one staged commit.
+    """
+    state = module.params['state']
+    snapshot_ttl = module.params['snapshot_ttl']
+    port_args = get_port_args(module.params['ports'], module.params)
+    port = module.params['port']
+
+    for name, args in port_args:
+        if state == 'present':
+            if not args.get('link_type'):
+                safe_fail(module, device, name=name,
+                          msg='link_type is required for every port.')
+            if args['link_type'] == 'access' and \
+                    args.get('permitted_vlans'):
+                safe_fail(module, device, name=name,
+                          msg='Access interfaces don\'t take'
+                          + ' permitted vlan lists.')
+            msg = check_vlan_args(args)
+            if msg:
+                safe_fail(module, device, name=name, msg=msg)
+        try:
+            args.update(normalize_vlans(args))
+        except ValueError as e:
+            safe_fail(module, device, name=name, msg=str(e))
+
+    try:
+        vlan_ids = set()
+        if state != 'default' and \
+                any(args.get('pvid') for name, args in port_args):
+            vlan_ids = set(get_snapshot(hostname, port, snapshot_ttl,
+                                        'vlans', Vlan(device).get_vlan_list))
+        iface_table = get_iface_table(device)
+        pc_members = set(get_snapshot(
+            hostname, port, snapshot_ttl, 'portchannel_members',
+            lambda: get_pc_members(device, iface_table)))
+        switchport_table = get_switchport_table(device)
+    except PYHPError as e:
+        safe_fail(module, device, msg=str(e),
+                  descr='Error getting existing config.')
+
+    switchports = []
+    for name, args in port_args:
+        try:
+            switchport = TableSwitchport(device, name, iface_table,
+                                         switchport_table)
+        except PYHPError as e:
+            safe_fail(module, device, name=name, msg=str(e),
+                      descr='Error initialzing Switchport object.')
+
+        if state != 'default' and args.get('pvid') \
+                and args['pvid'] not in vlan_ids:
+            safe_fail(module, device, name=name,
+                      msg='Vlan {0} does not exist,'.format(args['pvid'])
+                      + ' Use vlan module to create it.')
+        if switchport.interface_name in pc_members:
+            safe_fail(module, device, name=name,
+                      msg='{0} is currently part of a port'.format(name)
+                      + ' channel.  Changes should be made to the port'
+                      + ' channel interface.')
+        if not switchport.interface.iface_exists:
+            safe_fail(module, device, name=name,
+                      msg='{0} doesn\'t exist on the device.'.format(name))
+        if switchport.interface.is_routed:
+            safe_fail(module, device, name=name,
+                      msg='{0} is not in bridged mode.'.format(name)
+                      + ' Please use the interface module to change that.')
+        switchports.append((switchport, args))
+
+    proposed = {}
+    existing = {}
+    deltas = []
+    increment_commands = []
+    for switchport, args in switchports:
+        name = switchport.interface_name
+        proposed[name] = args
+        existing[name] = normalize_vlans(switchport.get_config())
+
+        if state == 'present':
+            try:
+                add, remove = get_vlan_increment(existing[name], args)
+            except ValueError as e:
+                safe_fail(module, device, name=name, msg=str(e))
+            if add or remove:
+                increment_commands.extend(
+                    get_increment_commands(name, add, remove))
+
+            delta = dict((k, v) for k, v in args.iteritems()
+                         if k not in VLAN_KEYS[1:]
+                         and existing[name].get(k) != v)
+            if delta or add or remove:
+                delta['link_type'] = args.get('link_type')
+                if args.get('pvid'):
+                    delta['pvid'] = args['pvid']
+                deltas.append((switchport, delta))
+        elif state == 'default':
+            defaults = switchport.get_default()
+            delta = dict(set(existing[name].iteritems()).difference(
+                defaults.iteritems()))
+            if delta:
+                deltas.append((switchport, dict(defaults)))
+
+    # every link type conversion is staged ahead of the VLAN settings
+    # so that the rows of each table can be merged into one edit
+    for switchport, delta in deltas:
+        if switchport.link_type != delta['link_type']:
+            switchport.convert_interface(delta['link_type'], stage=True)
+            switchport.link_type = delta['link_type']
+    for switchport, delta in sorted(deltas,
+                                    key=lambda item: item[1]['link_type']):
+        switchport.build(stage=True, **delta)
+
+    merge_staged(device)
+
+    # the VLANs added to and removed from trunks go out as one CLI
+    # request after the trunks exist
+    if increment_commands:
+        device.stage_config(increment_commands, 'cli_config')
+
+    changed = False
+    commands = None
+    end_state = existing
+
+    if device.staged:
+        commands = device.staged_to_string()
+        if module.check_mode:
+            safe_exit(module, device, changed=True,
+                      commands=commands)
+        else:
+            try:
+                device.execute_staged()
+                switchport_table.clear()
+                switchport_table.update(get_switchport_table(device))
+                end_state = dict((switchport.interface_name,
+                                  normalize_vlans(switchport.get_config()))
+                                 for switchport, args in switchports)
+            except PYHPError as e:
+                safe_fail(module, device, msg=str(e),
+                          descr='Error during command execution.')
+            changed = True
+
+    results = {}
+    results['proposed'] = proposed
+    results['existing'] = existing
+    results['state'] = state
+    results['commands'] = commands
+    results['changed'] = changed
+    results['end_state'] = end_state
+
+    safe_exit(module, device, **results)
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            name=dict(required=True),
-            link_type=dict(required=True,
+            name=dict(required=False),
+            ports=dict(required=False, type='list'),
+            link_type=dict(required=False,
                            choices=['access', 'trunk']),
             pvid=dict(type='str'),
             permitted_vlans=dict(type='str'),
+            permitted_vlans_add=dict(type='str'),
+            permitted_vlans_remove=dict(type='str'),
             state=dict(choices=['present', 'default'],
                        default='present'),
+            snapshot_ttl=dict(default=0, type='int'),
             hostname=dict(required=True),
             username=dict(required=True),
             password=dict(required=True),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(type='int', default=830)
         ),
         supports_check_mode=True
@@ -149,10 +826,19 @@ def main():
         safe_fail(module,
                   msg='There was a problem loading from the pyhpecw7 module')
 
+    if module.params['name'] and module.params['ports']:
+        module.fail_json(msg='name and ports are mutually exclusive')
+    if not (module.params['name'] or module.params['ports']):
+        module.fail_json(msg='one of name or ports is required')
+    if module.params['name'] and not module.params['link_type']:
+        module.fail_json(msg='link_type is required with name')
+
     filtered_keys = ('state', 'hostname', 'username', 'password',
-                     'port', 'CHECKMODE', 'name')
+                     'port', 'CHECKMODE', 'name', 'ports', 'snapshot_ttl',
+                     'dns_ttl')
 
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
@@ -160,8 +846,18 @@ def main():
     device = HPCOM7(host=hostname, username=username,
                     password=password, port=port)
 
+    if module.params['ports']:
+        try:
+            device.open()
+        except ConnectionError as e:
+            safe_fail(module, device, msg=str(e),
+                      descr='Error opening connection to device.')
+
+        bulk_switchports(module, device, hostname)
+
     name = module.params['name']
     state = module.params['state']
+    snapshot_ttl = module.params['snapshot_ttl']
     changed = False
 
     if state == 'present':
@@ -170,6 +866,9 @@ def main():
                 safe_fail(module,
                           msg='Access interfaces don\'t take'
                           + ' permitted vlan lists.')
+        msg = check_vlan_args(module.params)
+        if msg:
+            safe_fail(module, msg=msg)
 
     try:
         device.open()
@@ -181,8 +880,13 @@ def main():
     pvid = module.params.get('pvid')
     if pvid and state != 'default':
         try:
-            vlan = Vlan(device, pvid)
-            if not vlan.get_config():
+            if snapshot_ttl:
+                vlan_ids = get_snapshot(hostname, port, snapshot_ttl, 'vlans',
+                                        Vlan(device).get_vlan_list)
+                vlan_exists = pvid in vlan_ids
+            else:
+                vlan_exists = bool(Vlan(device, pvid).get_config())
+            if not vlan_exists:
                 safe_fail(module, device,
                           msg='Vlan {0} does not exist,'.format(pvid)
                           + ' Use vlan module to create it.')
@@ -194,7 +898,9 @@ def main():
     # Make sure port is not part of port channel
     try:
         portchannel = Portchannel(device, '99', 'bridged')
-        pc_list = portchannel.get_all_members()
+        pc_list = get_snapshot(hostname, port, snapshot_ttl,
+                               'portchannel_members',
+                               portchannel.get_all_members)
     except PYHPError as e:
         module.fail_json(msg=str(e),
                          descr='Error getting port channel information.')
@@ -216,34 +922,53 @@ def main():
 
     # Make sure interface is in bridged mode
     try:
-        if_info = switchport.interface.get_config()
+        if snapshot_ttl:
+            iface_types = get_snapshot(hostname, port, snapshot_ttl,
+                                       'interface_types',
+                                       lambda: get_iface_types(device))
+            if_type = iface_types.get(switchport.interface_name)
+        else:
+            if_type = switchport.interface.get_config().get('type')
     except PYHPError as e:
         safe_fail(module, device, msg=str(e),
                   descr='Error getting current interface config.')
 
-    if if_info.get('type') != 'bridged':
+    if if_type != 'bridged':
         safe_fail(module, device, msg='{0} is not in bridged mode.'.format(name)
                   + ' Please use the interface module to change that.')
 
     try:
-        existing = switchport.get_config()
+        existing = normalize_vlans(switchport.get_config())
     except PYHPError as e:
         safe_fail(module, device, msg=str(e),
                   descr='Error getting switchpot config.')
 
     proposed = dict((k, v) for k, v in module.params.iteritems()
                     if v is not None and k not in filtered_keys)
+    try:
+        proposed = normalize_vlans(proposed)
+    except ValueError as e:
+        safe_fail(module, device, msg=str(e))
 
     if state == 'present':
-        delta = dict(set(proposed.iteritems()).difference(
-            existing.iteritems()))
-        if delta:
+        try:
+            add, remove = get_vlan_increment(existing, proposed)
+        except ValueError as e:
+            safe_fail(module, device, msg=str(e))
+
+        delta = dict((k, v) for k, v in proposed.iteritems()
+                     if k not in VLAN_KEYS[1:] and existing.get(k) != v)
+        if delta or add or remove:
             delta['link_type'] = proposed.get('link_type')
             pvid = proposed.get('pvid')
             if pvid:
                 delta['pvid'] = pvid
 
             switchport.build(stage=True, **delta)
+        if add or remove:
+            device.stage_config(
+                get_increment_commands(switchport.interface_name,
+                                       add, remove), 'cli_config')
     elif state == 'default':
         defaults = switchport.get_default()
         delta = dict(set(existing.iteritems()).difference(
@@ -262,7 +987,7 @@ def main():
         else:
             try:
                 device.execute_staged()
-                end_state = switchport.get_config()
+                end_state = normalize_vlans(switchport.get_config())
             except PYHPError as e:
                 safe_fail(module, device, msg=str(e),
                           descr='Error during command execution.')
@@ -13,8 +13,20 @@ category: Feature (RW)
 options:
     vlanid:
         description:
-            - VLAN ID to configure
-        required: true
+            - VLAN ID to configure.  Mutually exclusive with vlans.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+    vlans:
+        description:
+            - List of VLANs to configure in a single run.  Each entry
+              is either a dictionary with the keys vlanid, name and descr,
+              or a VLAN ID/range string such as 10-200.  A plain
+              range string such as "10-200,300" is also accepted.
+              name and descr, if set, are used for every entry that
+              does not define its own.  Mutually exclusive with vlanid.
+        required: false
         default: null
         choices: []
         aliases: []
@@ -32,6 +44,30 @@ options:
         default: null
         choices: []
         aliases: []
+    end_state:
+        description:
+            - How end_state is reported after changes are committed.
+              fetched reads the config back from the switch.  computed
+              applies the committed changes to the existing config
+              without another read, so values the switch fills in on
+              its own are not included.  verified does both and fails
+              if the fetched config does not match the computed one.
+              none skips end_state.
+        required: false
+        default: fetched
+        choices: ['fetched', 'computed', 'verified', 'none']
+        aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -81,15 +117,33 @@ EXAMPLES = """
 # ensure VLAN 10 does not exist
 - comware_vlan: vlanid=10 state=absent username={{ username }} password={{ password }} hostname={{ inventory_hostname }}
 
+# ensure VLANs 10-200 and 300 exist in one run
+- comware_vlan: vlans="10-200,300" username={{ username }} password={{ password }} hostname={{ inventory_hostname }}
+
+# ensure a list of named VLANs exist
+- comware_vlan:
+    vlans:
+      - vlanid: 10
+        name: WEB
+      - vlanid: 20
+        name: APP
+        descr: APPSEGMENT
+    username: "{{ username }}"
+    password: "{{ password }}"
+    hostname: "{{ inventory_hostname }}"
+
 """
 
-import socket
+import re
+from ansible.module_utils.comware_cache import (
+    resolve_hostname, invalidate_snapshot)
 try:
     HAS_PYHP = True
     from pyhpecw7.features.vlan import Vlan
     from pyhpecw7.comware import HPCOM7
     from pyhpecw7.features.errors import *
     from pyhpecw7.errors import *
+    from pyhpecw7.utils.xml.lib import *
 except ImportError as ie:
     HAS_PYHP = False
 
@@ -106,13 +160,241 @@ def safe_exit(module, device=None, **kwargs):
     module.exit_json(**kwargs)
 
 
+def end_state_mismatch(computed, fetched):
+    """Return True if the fetched end state does not match
+    the computed one on the keys the computed one sets.
+    """
+    if bool(computed) != bool(fetched):
+        return True
+    return any(fetched.get(k) != v for k, v in computed.iteritems())
+
+
+class VlanSet(object):
+    """VLAN IDs kept as sorted, non-overlapping (low, high) ranges,
+    so that overlapping entries such as 1-10,5 yield each ID once.
+    """
+    def __init__(self, ranges=()):
+        self.ranges = []
+        for low, high in sorted(ranges):
+            self._append(low, high)
+
+    def _append(self, low, high):
+        # ranges must be appended in order of low
+        if self.ranges and low <= self.ranges[-1][1] + 1:
+            if high > self.ranges[-1][1]:
+                self.ranges[-1] = (self.ranges[-1][0], high)
+        else:
+            self.ranges.append((low, high))
+
+    @classmethod
+    def parse(cls, vlans):
+        """Parse VLAN IDs given as a Comware range string such as
+        1-3,5 (or the CLI form 1 to 3 5), a single ID, or a list of
+        either.  Raises ValueError for IDs outside 1-4094.
+        """
+        if vlans is None:
+            return cls()
+        if not isinstance(vlans, (list, tuple)):
+            vlans = [vlans]
+
+        ranges = []
+        for item in vlans:
+            text = re.sub(r'\s+to\s+', '-', str(item).strip())
+            for each in re.split(r'[,\s]+', text):
+                if not each:
+                    continue
+                if '-' in each:
+                    low, high = each.split('-', 1)
+                    low, high = int(low), int(high)
+                else:
+                    low = high = int(each)
+                if not 1 <= low <= high <= 4094:
+                    raise ValueError('invalid VLAN range {0}'.format(each))
+                ranges.append((low, high))
+
+        return cls(ranges)
+
+    def __iter__(self):
+        for low, high in self.ranges:
+            for vlanid in range(low, high + 1):
+                yield vlanid
+
+
+def get_vlan_args(vlans, name, descr):
+    """Build the list of per-VLAN argument dictionaries
+    from the vlans param.
+    """
+    if not isinstance(vlans, list):
+        vlans = [vlans]
+
+    vlan_args = []
+    for entry in vlans:
+        if isinstance(entry, dict):
+            # normalized like the IDs parsed from a range, so that
+            # 010 and 10 are the same VLAN
+            try:
+                vlanid = int(entry.get('vlanid'))
+            except (TypeError, ValueError):
+                vlanid = None
+            if vlanid is None or not 1 <= vlanid <= 4094:
+                raise ValueError('invalid VLAN ID {0}'.format(
+                    entry.get('vlanid')))
+            args = dict(vlanid=str(vlanid),
+                        name=entry.get('name', name),
+                        descr=entry.get('descr', descr))
+            vlan_args.append(args)
+        else:
+            for vlanid in VlanSet.parse(entry):
+                vlan_args.append(dict(vlanid=str(vlanid), name=name,
+                                      descr=descr))
+
+    return vlan_args
+
+
+def get_vlan_table(device):
+    """Get the config of every VLAN on the switch with one NETCONF get.
+
+    Returns:
+        A dictionary of VLAN config dictionaries keyed by VLAN ID.
+    """
+    vlan = Vlan(device)
+    nc_get_reply = device.get(('subtree', vlan.gen_top()))
+
+    table = {}
+    for vlan_ele in findall_in_data('VLANID', nc_get_reply.data_ele):
+        vlan_config = data_elem_to_dict(vlan_ele, vlan.vlan_key_map)
+        table[vlan_config.get('vlanid')] = vlan_config
+
+    return table
+
+
+def stage_merged(device, configs):
+    """Merge the VLAN entries of several VLAN edit-config objects
+    into the first one and stage it as a single edit-config.
+    """
+    merged = configs[0]
+    merged_vlans = find_in_config('VLANs', merged)
+    for config in configs[1:]:
+        for vlan_ele in list(find_in_config('VLANs', config)):
+            merged_vlans.append(vlan_ele)
+
+    device.stage_config(merged, 'edit_config')
+
+
+def bulk_vlans(module, device):
+    """Configure every VLAN in the vlans param with one read of
+    the VLAN table and one edit-config.
+    """
+    state = module.params['state']
+    end_state_mode = module.params['end_state']
+    try:
+        vlan_args = get_vlan_args(module.params['vlans'],
+                                  module.params['name'],
+                                  module.params['descr'])
+    except ValueError as e:
+        safe_fail(module, device, msg=str(e))
+
+    vlans = {}
+    proposed = {}
+    for args in vlan_args:
+        vlanid = args['vlanid']
+        proposed[vlanid] = dict((k, v) for k, v in args.iteritems()
+                                if v is not None)
+        try:
+            vlans[vlanid] = Vlan(device, vlanid)
+            vlans[vlanid].param_check(**proposed[vlanid])
+        except LengthOfStringError as lose:
+            safe_fail(module, device, msg=str(lose), vlanid=vlanid)
+        except VlanIDError as vie:
+            safe_fail(module, device, msg=str(vie), vlanid=vlanid)
+        except PYHPError as e:
+            safe_fail(module, device, msg=str(e), vlanid=vlanid)
+
+    try:
+        table = get_vlan_table(device)
+    except PYHPError as e:
+        safe_fail(module, device, msg=str(e),
+                  descr='error getting vlan config')
+
+    existing = dict((vlanid, table.get(vlanid, {})) for vlanid in proposed)
+
+    configs = []
+    computed = {}
+    for vlanid in sorted(proposed, key=int):
+        if state == 'present':
+            delta = dict(set(proposed[vlanid].iteritems()).difference(
+                existing[vlanid].iteritems()))
+            if delta:
+                configs.append(
+                    vlans[vlanid]._build_config(state='present', **delta))
+            computed[vlanid] = dict(existing[vlanid], **delta)
+        elif state == 'absent':
+            if existing[vlanid]:
+                configs.append(vlans[vlanid]._build_config(state='absent'))
+            computed[vlanid] = {}
+
+    if configs:
+        stage_merged(device, configs)
+
+    changed = False
+    commands = None
+    end_state = existing
+
+    if device.staged:
+        commands = device.staged_to_string()
+        if module.check_mode:
+            safe_exit(module, device, changed=True,
+                      commands=commands)
+        else:
+            try:
+                device.execute_staged()
+                invalidate_snapshot(device.host, device.port, ['vlans'])
+                if end_state_mode in ['fetched', 'verified']:
+                    table = get_vlan_table(device)
+                    end_state = dict((vlanid, table.get(vlanid, {}))
+                                     for vlanid in proposed)
+            except PYHPError as e:
+                safe_fail(module, device, msg=str(e),
+                          descr='error during execution')
+            changed = True
+
+            if end_state_mode == 'computed':
+                end_state = computed
+            elif end_state_mode == 'verified':
+                mismatched = [vlanid for vlanid in computed
+                              if end_state_mismatch(computed[vlanid],
+                                                    end_state[vlanid])]
+                if mismatched:
+                    safe_fail(module, device, vlans=mismatched,
+                              msg='end state does not match the computed'
+                              + ' end state', computed=computed,
+                              end_state=end_state)
+            elif end_state_mode == 'none':
+                end_state = None
+
+    results = {}
+    results['proposed'] = proposed
+    results['existing'] = existing
+    results['state'] = state
+    results['commands'] = commands
+    results['changed'] = changed
+    results['end_state'] = end_state
+
+    safe_exit(module, device, **results)
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            vlanid=dict(required=True, type='str'),
+            vlanid=dict(required=False, type='str'),
+            vlans=dict(required=False, type='list'),
             name=dict(required=False),
             descr=dict(required=False),
             state=dict(choices=['present', 'absent'], default='present'),
+            end_state=dict(choices=['fetched', 'computed', 'verified',
+                                    'none'],
+                           default='fetched'),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(default=830, type='int'),
             hostname=dict(required=True),
             username=dict(required=True),
@@ -124,21 +406,36 @@ def main():
         module.fail_json(msg='There was a problem loading from the pyhpecw7 '
                          + 'module.', error=str(ie))
 
+    if module.params['vlanid'] and module.params['vlans']:
+        module.fail_json(msg='vlanid and vlans are mutually exclusive')
+    if not (module.params['vlanid'] or module.params['vlans']):
+        module.fail_json(msg='one of vlanid or vlans is required')
+
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
 
     device_args = dict(host=hostname, username=username,
                        password=password, port=port)
 
     device = HPCOM7(**device_args)
 
+    if module.params['vlans']:
+        try:
+            device.open()
+        except ConnectionError as e:
+            safe_fail(module, device, msg=str(e))
+
+        bulk_vlans(module, device)
+
     vlanid = module.params['vlanid']
     name = module.params['name']
     descr = module.params['descr']
 
     state = module.params['state']
+    end_state_mode = module.params['end_state']
 
     changed = False
 
@@ -171,9 +468,11 @@ def main():
             existing.iteritems()))
         if delta:
             vlan.build(stage=True, **delta)
+        computed = dict(existing, **delta)
     elif state == 'absent':
         if existing:
             vlan.remove(stage=True)
+        computed = {}
 
     commands = None
     end_state = existing
@@ -187,12 +486,25 @@ def main():
         else:
             try:
                 device.execute_staged()
-                end_state = vlan.get_config()
+                invalidate_snapshot(hostname, port, ['vlans'])
+                if end_state_mode in ['fetched', 'verified']:
+                    end_state = vlan.get_config()
             except PYHPError as e:
                 safe_fail(module, device, msg=str(e),
                           descr='error during execution')
             changed = True
 
+            if end_state_mode == 'computed':
+                end_state = computed
+            elif end_state_mode == 'verified':
+                if end_state_mismatch(computed, end_state):
+                    safe_fail(module, device,
+                              msg='end state does not match the computed'
+                              + ' end state', computed=computed,
+                              end_state=end_state)
+            elif end_state_mode == 'none':
+                end_state = None
+
     results = {}
     results['proposed'] = proposed
     results['existing'] = existing
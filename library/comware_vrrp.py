@@ -82,6 +82,19 @@ options:
         default: present
         choices: ['present', 'absent', 'shutdown', 'undoshutdown']
         aliases: []
+    end_state:
+        description:
+            - How end_state is reported after changes are committed.
+              fetched reads the config back from the switch.  computed
+              applies the committed changes to the existing config
+              without another read, so values the switch fills in on
+              its own are not included.  verified does both and fails
+              if the fetched config does not match the computed one.
+              none skips end_state.
+        required: false
+        default: fetched
+        choices: ['fetched', 'computed', 'verified', 'none']
+        aliases: []
     hostname:
         description:
             - IP Address or hostname of the Comware v7 device that has
@@ -104,6 +117,17 @@ options:
         default: null
         choices: []
         aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -132,7 +156,7 @@ EXAMPLES = """
 
 """
 
-import socket
+from ansible.module_utils.comware_cache import resolve_hostname
 try:
     HAS_PYHP = True
     from pyhpecw7.features.vrrp import VRRP
@@ -156,6 +180,15 @@ def safe_exit(module, device=None, **kwargs):
     module.exit_json(**kwargs)
 
 
+def end_state_mismatch(computed, fetched):
+    """Return True if the fetched end state does not match
+    the computed one on the keys the computed one sets.
+    """
+    if bool(computed) != bool(fetched):
+        return True
+    return any(fetched.get(k) != v for k, v in computed.iteritems())
+
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
@@ -170,6 +203,10 @@ def main():
             state=dict(choices=['present', 'absent', 'shutdown',
                                 'undoshutdown'],
                        default='present'),
+            end_state=dict(choices=['fetched', 'computed', 'verified',
+                                    'none'],
+                           default='fetched'),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(default=830, type='int'),
             hostname=dict(required=True),
             username=dict(required=True),
@@ -184,7 +221,8 @@ def main():
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
 
     device_args = dict(host=hostname, username=username,
                        password=password, port=port)
@@ -208,6 +246,7 @@ def main():
             module.fail_json(msg='auth_mode is required when setting auth')
 
     state = module.params['state']
+    end_state_mode = module.params['end_state']
 
     changed = False
 
@@ -242,6 +281,9 @@ def main():
         safe_fail(module, device, msg=str(e),
                   descr='could not get existing config')
 
+    # the switch reports the key as a cipher and does not report
+    # the interface, so neither is part of the computed end state
+    computed = dict(existing)
     if state == 'present':
         delta = dict(set(proposed.iteritems()).difference(
             existing.iteritems()))
@@ -252,15 +294,21 @@ def main():
                 delta['auth_mode'] = auth_mode
                 delta['key_type'] = key_type
             vrrp.build(stage=True, state=state, **delta)
+        computed.update(proposed)
+        for k in ['interface', 'key', 'key_type']:
+            computed.pop(k, None)
     elif state == 'absent':
         if existing:
             vrrp.remove(stage=True)
+        computed = {}
     elif state == 'shutdown':
         if existing.get('admin') == 'Up':
             vrrp.shutdown(stage=True)
+            computed['admin'] = 'Down'
     elif state == 'undoshutdown':
         if existing.get('admin') == 'Down':
             vrrp.undoshutdown(stage=True)
+            computed['admin'] = 'Up'
 
     commands = None
     end_state = existing
@@ -275,12 +323,24 @@ def main():
         else:
             try:
                 response = device.execute_staged()
-                end_state = vrrp.get_config()
+                if end_state_mode in ['fetched', 'verified']:
+                    end_state = vrrp.get_config()
             except PYHPError as e:
                 safe_fail(module, device, msg=str(e),
                           descr='error during execution')
             changed = True
 
+            if end_state_mode == 'computed':
+                end_state = computed
+            elif end_state_mode == 'verified':
+                if end_state_mismatch(computed, end_state):
+                    safe_fail(module, device,
+                              msg='end state does not match the computed'
+                              + ' end state', computed=computed,
+                              end_state=end_state)
+            elif end_state_mode == 'none':
+                end_state = None
+
     results = {}
     results['proposed'] = proposed
     results['existing'] = existing
@@ -51,6 +51,19 @@ options:
         default: present
         choices: ['present', 'absent']
         aliases: []
+    end_state:
+        description:
+            - How end_state is reported after changes are committed.
+              fetched reads the config back from the switch.  computed
+              applies the committed changes to the existing config
+              without another read, so values the switch fills in on
+              its own are not included.  verified does both and fails
+              if the fetched config does not match the computed one.
+              none skips end_state.
+        required: false
+        default: fetched
+        choices: ['fetched', 'computed', 'verified', 'none']
+        aliases: []
     hostname:
         description:
             - IP Address or hostname of the Comware v7 device that has
@@ -73,6 +86,28 @@ options:
         default: null
         choices: []
         aliases: []
+    snapshot_ttl:
+        description:
+            - Seconds for which the global L2VPN state is cached on the
+              Ansible controller and shared with later tasks against the
+              same switch.  The cache is cleared when comware_l2vpn_global,
+              comware_install_config or comware_command (type=config)
+              commit changes.  0 disables the cache.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -102,7 +137,7 @@ EXAMPLES = """
 
 """
 
-import socket
+from ansible.module_utils.comware_cache import resolve_hostname, get_snapshot
 try:
     HAS_PYHP = True
     from pyhpecw7.features.vxlan import Vxlan, Tunnel
@@ -126,6 +161,15 @@ def safe_exit(module, device=None, **kwargs):
     module.exit_json(**kwargs)
 
 
+def end_state_mismatch(computed, fetched):
+    """Return True if the fetched end state does not match
+    the computed one on the keys the computed one sets.
+    """
+    if bool(computed) != bool(fetched):
+        return True
+    return any(fetched.get(k) != v for k, v in computed.iteritems())
+
+
 def normalize_to_list(data):
     if isinstance(data, str) or isinstance(data, unicode):
         return [data]
@@ -150,6 +194,11 @@ def main():
             tunnels=dict(required=False),
             descr=dict(required=False),
             state=dict(choices=['present', 'absent'], default='present'),
+            end_state=dict(choices=['fetched', 'computed', 'verified',
+                                    'none'],
+                           default='fetched'),
+            snapshot_ttl=dict(default=0, type='int'),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(default=830, type='int'),
             hostname=dict(required=True),
             username=dict(required=True),
@@ -164,7 +213,8 @@ def main():
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
 
     device_args = dict(host=hostname, username=username,
                        password=password, port=port)
@@ -177,6 +227,7 @@ def main():
     tunnels = normalize_to_list(module.params['tunnels'])
 
     state = module.params['state']
+    end_state_mode = module.params['end_state']
 
     changed = False
 
@@ -190,7 +241,9 @@ def main():
 
     try:
         l2vpn = L2VPN(device)
-        is_l2vpn_enabled = l2vpn.get_config()
+        is_l2vpn_enabled = get_snapshot(hostname, port,
+                                        module.params['snapshot_ttl'],
+                                        'l2vpn', l2vpn.get_config)
     except PYHPError as e:
         safe_fail(module, device, msg=str(e), descr='L2VPN check failed')
 
@@ -228,11 +281,15 @@ def main():
     if tunnels_to_remove:
         delta['tunnels_to_remove'] = tunnels_to_remove
 
+    computed = {}
     if state == 'present':
         if not existing.get('vxlan'):
             VXLAN.create(stage=True)
         if delta:
             VXLAN.build(stage=True, **delta)
+        computed = dict(existing, **proposed)
+        if tunnels:
+            computed['tunnels'] = sorted(tunnels)
     elif state == 'absent':
         if existing:
             # existing is based off the VXLAN ID
@@ -256,12 +313,27 @@ def main():
         else:
             try:
                 device.execute_staged()
-                end_state = VXLAN.get_config()
+                if end_state_mode in ['fetched', 'verified']:
+                    end_state = VXLAN.get_config()
             except PYHPError as e:
                 safe_fail(module, device, msg=str(e),
                           descr='failed during execution')
             changed = True
 
+            if end_state_mode == 'computed':
+                end_state = computed
+            elif end_state_mode == 'verified':
+                fetched = dict(end_state)
+                if fetched.get('tunnels'):
+                    fetched['tunnels'] = sorted(fetched['tunnels'])
+                if end_state_mismatch(computed, fetched):
+                    safe_fail(module, device,
+                              msg='end state does not match the computed'
+                              + ' end state', computed=computed,
+                              end_state=end_state)
+            elif end_state_mode == 'none':
+                end_state = None
+
     if tunnels:
         proposed.update(tunnels=tunnels)
     if existing_tunnels:
@@ -90,6 +90,28 @@ options:
         default: null
         choices: []
         aliases: []
+    snapshot_ttl:
+        description:
+            - Seconds for which the global L2VPN state is cached on the
+              Ansible controller and shared with later tasks against the
+              same switch.  The cache is cleared when comware_l2vpn_global,
+              comware_install_config or comware_command (type=config)
+              commit changes.  0 disables the cache.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
+    dns_ttl:
+        description:
+            - Seconds for which the address hostname resolves to is
+              cached on the Ansible controller and shared with later
+              tasks against the same switch.  0 resolves hostname on
+              every run.  DNS is not used when hostname is an IPv4
+              address.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
     port:
         description:
             - NETCONF port number
@@ -114,7 +136,7 @@ EXAMPLES = """
 
 """
 
-import socket
+from ansible.module_utils.comware_cache import resolve_hostname, get_snapshot
 try:
     HAS_PYHP = True
     from pyhpecw7.features.vxlan import L2EthService
@@ -163,6 +185,8 @@ def main():
             access_mode=dict(required=False, choices=['ethernet', 'vlan'],
                              default='vlan'),
             state=dict(choices=['present', 'absent'], default='present'),
+            snapshot_ttl=dict(default=0, type='int'),
+            dns_ttl=dict(default=0, type='int'),
             port=dict(default=830, type='int'),
             hostname=dict(required=True),
             username=dict(required=True),
@@ -177,7 +201,8 @@ def main():
     username = module.params['username']
     password = module.params['password']
     port = module.params['port']
-    hostname = socket.gethostbyname(module.params['hostname'])
+    hostname = resolve_hostname(module.params['hostname'],
+                                module.params['dns_ttl'])
 
     device_args = dict(host=hostname, username=username,
                        password=password, port=port)
@@ -212,7 +237,9 @@ def main():
 
     try:
         l2vpn = L2VPN(device)
-        is_l2vpn_enabled = l2vpn.get_config()
+        is_l2vpn_enabled = get_snapshot(hostname, port,
+                                        module.params['snapshot_ttl'],
+                                        'l2vpn', l2vpn.get_config)
     except PYHPError as e:
         safe_fail(module, device, msg=str(e),
                   descr='L2VPN config check failed')
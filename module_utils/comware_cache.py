@@ -0,0 +1,194 @@
+"""Caches kept on the Ansible controller and shared by the comware
+modules between tasks against the same switch: the address each
+hostname resolves to, and the device snapshot of modules that use
+snapshot_ttl.
+
+The caches live in ~/.ansible/tmp, in directories only the user
+running Ansible can write to.  Files not owned by that user are
+ignored, so nobody else on the controller can feed the modules an
+address to send the switch credentials to.
+"""
+
+import fcntl
+import json
+import os
+import re
+import socket
+import stat
+import time
+from contextlib import contextmanager
+
+
+CACHE_ROOT = os.path.join(os.path.expanduser('~'), '.ansible', 'tmp')
+
+
+def cache_dir(name):
+    """Return the private directory the cache called name is kept in,
+    created with mode 0700, or None if it cannot be used.
+    """
+    path = os.path.join(CACHE_ROOT, 'comware_' + name)
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path, 0o700)
+        path_stat = os.lstat(path)
+        if not stat.S_ISDIR(path_stat.st_mode) \
+                or path_stat.st_uid != os.getuid():
+            return None
+        if path_stat.st_mode & 0o077:
+            os.chmod(path, 0o700)
+    except OSError:
+        return None
+    return path
+
+
+def is_private_file(path):
+    """Return True if path is a regular file owned by the current
+    user that nobody else can write to.
+    """
+    try:
+        path_stat = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISREG(path_stat.st_mode) \
+        and path_stat.st_uid == os.getuid() \
+        and not path_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def open_private(path):
+    """Open path for writing with mode 0600, whatever the umask.
+    """
+    return os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                             0o600), 'w')
+
+
+def resolve_hostname(hostname, ttl=0):
+    """Return the IPv4 address of hostname.  Addresses are returned
+    as they are, and with a ttl the lookup is cached on disk and
+    shared with later tasks against the same switch.
+    """
+    if re.match(r'^\d+\.\d+\.\d+\.\d+$', hostname):
+        return hostname
+    directory = cache_dir('resolve') if ttl else None
+    if not directory or os.sep in hostname:
+        return socket.gethostbyname(hostname)
+
+    path = os.path.join(directory, hostname)
+    try:
+        if is_private_file(path) \
+                and time.time() - os.path.getmtime(path) < ttl:
+            with open(path) as resolve_file:
+                address = resolve_file.read().strip()
+            if address:
+                return address
+    except (IOError, OSError):
+        pass
+
+    address = socket.gethostbyname(hostname)
+    try:
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open_private(tmp_path) as resolve_file:
+            resolve_file.write(address)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+    return address
+
+
+def snapshot_path(hostname, port):
+    directory = cache_dir('snapshot')
+    if not directory:
+        return None
+    return os.path.join(directory, '{0}_{1}.json'.format(hostname, port))
+
+
+@contextmanager
+def locked(path):
+    """Hold an exclusive lock on path for the read, change and write
+    back of the file by concurrent tasks.
+    """
+    lock_fd = os.open(path + '.lock', os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(lock_fd)
+
+
+def read_snapshot(path):
+    if not path or not is_private_file(path):
+        return {}
+    try:
+        with open(path) as snapshot_file:
+            return json.load(snapshot_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def change_snapshot(hostname, port, change):
+    """Apply change to the device snapshot under its lock and write
+    it back, or remove it when change leaves it empty.  The snapshot
+    is only a cache, so failing to write it is not an error.
+    """
+    path = snapshot_path(hostname, port)
+    if not path:
+        return
+    try:
+        with locked(path):
+            snapshot = read_snapshot(path)
+            change(snapshot)
+            if not snapshot:
+                if os.path.lexists(path):
+                    os.remove(path)
+                return
+            tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+            with open_private(tmp_path) as snapshot_file:
+                json.dump(snapshot, snapshot_file)
+            os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+
+def load_snapshot(hostname, port):
+    """Return the device snapshot, a dict of entries keyed by kind.
+    """
+    return read_snapshot(snapshot_path(hostname, port))
+
+
+def update_snapshot(hostname, port, kind, entry):
+    """Store entry as the kind entry of the device snapshot.
+    """
+    def store(snapshot):
+        snapshot[kind] = entry
+
+    change_snapshot(hostname, port, store)
+
+
+def get_snapshot(hostname, port, ttl, kind, fetch):
+    """Return the cached ``kind`` entry of the device snapshot kept
+    on the controller, calling ``fetch`` to refresh it when it is
+    missing or older than ``ttl`` seconds.  A ttl of 0 disables the cache.
+    """
+    if not ttl:
+        return fetch()
+
+    entry = load_snapshot(hostname, port).get(kind)
+    if entry and time.time() - entry['time'] < ttl:
+        return entry['data']
+
+    data = fetch()
+    update_snapshot(hostname, port, kind, dict(time=time.time(), data=data))
+
+    return data
+
+
+def invalidate_snapshot(hostname, port, kinds=None):
+    """Drop the given kinds, or the whole snapshot if kinds is None,
+    from the device snapshot kept on the controller by modules
+    that use snapshot_ttl.
+    """
+    def drop(snapshot):
+        for kind in list(snapshot if kinds is None else kinds):
+            snapshot.pop(kind, None)
+
+    change_snapshot(hostname, port, drop)